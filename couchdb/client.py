@@ -23,18 +23,36 @@ False
 >>> del server['python-tests']
 """
 
+from base64 import b64decode
+from cgi import parse_header
+from copy import deepcopy
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 import itertools
+import math
 import mimetypes
+import mmap
 import os
+import stat
+import sys
+from StringIO import StringIO
+try:
+    from threading import Lock, Thread, Timer
+except ImportError:
+    from dummy_threading import Lock, Thread, Timer
 from types import FunctionType
 from inspect import getsource
 from textwrap import dedent
 import re
 import warnings
+import zlib
 
-from couchdb import http, json
+from couchdb import http, json, multipart
 
-__all__ = ['Server', 'Database', 'Document', 'ViewResults', 'Row']
+__all__ = ['Server', 'Database', 'Document', 'ViewResults', 'Row',
+           'BatchLoader', 'BatchWriter', 'IdFilter']
 __docformat__ = 'restructuredtext en'
 
 
@@ -96,10 +114,31 @@ class Server(object):
         except http.ResourceNotFound:
             return False
 
+    iter_batch = 1000 # number of names fetched per request when iterating
+
     def __iter__(self):
-        """Iterate over the names of all databases."""
-        status, headers, data = self.resource.get_json('_all_dbs')
-        return iter(data)
+        """Iterate over the names of all databases.
+
+        The names are fetched in pages of `iter_batch` names, using the
+        ``startkey`` and ``limit`` options. Servers that do not support
+        these options for ``_all_dbs`` return all names in one response.
+        """
+        batch = self.iter_batch
+        last = None
+        while True:
+            options = {'limit': batch + 1}
+            if last is not None:
+                options['startkey'] = last
+            _, _, names = self.resource.get_json('_all_dbs',
+                                                 **_encode_view_options(options))
+            # The page starts with the last name of the previous one, and
+            # servers ignoring startkey may return names already seen.
+            new = [name for name in names if last is None or name > last]
+            for name in new:
+                yield name
+            if not new or len(names) != batch + 1:
+                break
+            last = names[-1]
 
     def __len__(self):
         """Return the number of databases."""
@@ -296,9 +335,17 @@ class Database(object):
         except http.ResourceNotFound:
             return False
 
+    iter_batch = 1000 # number of IDs fetched per request when iterating
+
     def __iter__(self):
-        """Return the IDs of all documents in the database."""
-        return iter([item.id for item in self.view('_all_docs')])
+        """Return the IDs of all documents in the database.
+
+        The IDs are fetched lazily in pages of `iter_batch` rows, so that
+        large databases can be iterated over without loading all IDs into
+        memory.
+        """
+        for row in self.iterview('_all_docs', self.iter_batch):
+            yield row.id
 
     def __len__(self):
         """Return the number of documents in the database."""
@@ -422,6 +469,98 @@ class Database(object):
             doc['_rev'] = rev
         return id, rev
 
+    def save_with_attachments(self, doc, attachments, **options):
+        """Create or update a document together with new attachments, using a
+        single request.
+
+        The document and the attachments are sent as a ``multipart/related``
+        body, so that the document gets only one new revision, and the
+        attachments are neither base64 encoded nor loaded into memory: file
+        objects of known size are only read while the request is being sent.
+
+        >>> from StringIO import StringIO
+        >>> server = Server()
+        >>> db = server.create('python-tests')
+        >>> doc = {'_id': 'report', 'type': 'Report'}
+        >>> db.save_with_attachments(doc, {
+        ...     'summary.txt': 'Nothing to report',
+        ...     'data.csv': (StringIO('a,b;1,2'), 'text/csv')
+        ... }) #doctest: +ELLIPSIS
+        ('report', '1-...')
+        >>> sorted(doc['_attachments'])
+        ['data.csv', 'summary.txt']
+        >>> db.get_attachment(doc, 'data.csv').read()
+        'a,b;1,2'
+
+        >>> del server['python-tests']
+
+        Attachments that are already stored with the document are kept if
+        the document includes their stubs. After the document is saved, its
+        ``_id``, ``_rev`` and ``_attachments`` fields are updated.
+
+        :param doc: the document to store, which must have an ``_id``
+        :param attachments: a dictionary mapping the names of the attachments
+                            to their content, either as strings or file-like
+                            objects, or to ``(content, content_type)`` tuples;
+                            if the content type is omitted, it is guessed
+                            based on the name
+        :param options: optional query string parameters
+        :return: (id, rev) tuple of the saved document
+        :rtype: `tuple`
+        :since: 0.10
+        """
+        if '_id' not in doc:
+            raise ValueError('document must have an _id')
+        stubs = dict(doc.get('_attachments') or {})
+        parts = {}
+        for filename, content in attachments.items():
+            content_type = None
+            if isinstance(content, tuple):
+                content, content_type = content
+            if content_type is None:
+                content_type = ';'.join(
+                    filter(None, mimetypes.guess_type(filename))
+                ) or 'application/octet-stream'
+            if isinstance(content, unicode):
+                content = content.encode('utf-8')
+            if isinstance(content, basestring):
+                size = len(content)
+                if not size: # would be written without a trailing line break
+                    content = StringIO(content)
+            else:
+                size = _remaining_size(content)
+                if size is None:
+                    content = content.read()
+                    size = len(content)
+            stubs[filename] = {'follows': True, 'content_type': content_type,
+                               'length': size}
+            parts[filename] = content
+
+        body = multipart.MultipartBody()
+        envelope = multipart.MultipartWriter(body, subtype='related',
+                                             envelope=False)
+        envelope.add('application/json',
+                     _encode_utf8(dict(doc.items(), _attachments=stubs)))
+        # The attachments must follow in the order of their stubs in the JSON
+        # document, which is the iteration order of the dictionary
+        for filename in stubs:
+            if filename in parts:
+                envelope.add(stubs[filename]['content_type'], parts[filename],
+                             {'Content-Length': str(stubs[filename]['length'])})
+        envelope.close()
+
+        resource = _doc_resource(self.resource, doc['_id'])
+        _, _, data = resource.put_json(body=body, headers={
+            'Content-Type': envelope.content_type,
+            'Content-Length': str(body.length)
+        }, **options)
+        for stub in stubs.values():
+            if stub.pop('follows', False):
+                stub['stub'] = True
+        doc['_attachments'] = stubs
+        doc['_rev'] = data['rev']
+        return data['id'], data['rev']
+
     def cleanup(self):
         """Clean up old design document indexes.
 
@@ -534,18 +673,58 @@ class Database(object):
             raise ValueError('document ID cannot be None')
         _doc_resource(self.resource, doc['_id']).delete_json(rev=doc['_rev'])
 
-    def get(self, id, default=None, **options):
+    def get(self, id, default=None, stream=False, **options):
         """Return the document with the specified ID.
 
+        If both the ``attachments`` option and `stream` are true, the document
+        is requested as ``multipart/related`` content, and the ``data`` of
+        every attachment is a file-like object instead of a base64 encoded
+        string:
+
+        >>> server = Server()
+        >>> db = server.create('python-tests')
+        >>> db.save_with_attachments({'_id': 'report'}, {
+        ...     'summary.txt': 'Nothing to report'
+        ... }) #doctest: +ELLIPSIS
+        ('report', '1-...')
+        >>> doc = db.get('report', attachments=True, stream=True)
+        >>> doc['_attachments']['summary.txt']['data'].read()
+        'Nothing to report'
+
+        >>> del server['python-tests']
+
+        The attachments are read from the response as their file-like objects
+        are read, and are best read in the order in which they are listed in
+        the document, because the content of those that are skipped over has
+        to be kept in memory. The connection is only returned to the pool once
+        all attachments have been read or closed, so the caller must make sure
+        that they are. If the server responds with JSON instead, the ``data``
+        is decoded into an in-memory file-like object.
+
+        Without `stream`, the ``data`` of every attachment is a base64 encoded
+        string, as returned by the server.
+
         :param id: the document ID
         :param default: the default value to return when the document is not
                         found
+        :param stream: whether attachments requested with the ``attachments``
+                       option are streamed from a ``multipart/related``
+                       response as file-like objects; ignored together with
+                       the ``open_revs`` option
         :return: a `Row` object representing the requested document, or `None`
                  if no document with the ID was found
         :rtype: `Document`
         """
+        resource = _doc_resource(self.resource, id)
         try:
-            _, _, data = _doc_resource(self.resource, id).get_json(**options)
+            if stream and options.get('attachments') and \
+                    'open_revs' not in options:
+                _, headers, body = resource.get(headers={
+                    'Accept': 'multipart/related, application/json'
+                }, **options)
+                data = _read_multipart_doc(headers, body)
+            else:
+                _, _, data = resource.get_json(**options)
         except http.ResourceNotFound:
             return default
         if hasattr(data, 'items'):
@@ -553,10 +732,116 @@ class Database(object):
         else:
             return data
 
-    def revisions(self, id, **options):
+    def get_many(self, ids, chunk_size=100, concurrency=4, default=None):
+        """Return the documents with the specified IDs, in the same order.
+
+        The IDs are fetched in chunks of `chunk_size` using ``_all_docs``
+        requests, of which up to `concurrency` are run in parallel on the
+        session's executor. Documents are yielded as soon as the chunk they
+        belong to has arrived, so `ids` can be a lazy iterable of any length.
+
+        :param ids: an iterable of document IDs
+        :param chunk_size: the number of IDs per request
+        :param concurrency: the number of parallel requests, see `Executor`
+        :param default: the value to yield for missing or deleted documents
+        :return: an iterator over `Document` objects
+        :since: 0.10
+        """
+        ids = iter(ids)
+        chunks = iter(lambda: list(itertools.islice(ids, chunk_size)), [])
+        executor = self.resource.session.executor
+        for docs in executor.map(self._get_chunk, chunks, concurrency):
+            for doc in docs:
+                if doc is None:
+                    yield default
+                else:
+                    yield Document(doc)
+
+    def _get_chunk(self, ids):
+        _, _, data = _call_viewlike(self.resource('_all_docs'), {
+            'keys': ids, 'include_docs': True
+        })
+        # The rows are returned in the order of the keys
+        return [row.get('doc') for row in data['rows']]
+
+    def contains_many(self, ids, chunk_size=100, concurrency=4,
+                      id_filter=None):
+        """Return whether the database contains documents with the specified
+        IDs.
+
+        The IDs are looked up in chunks of `chunk_size` using ``_all_docs``
+        requests that do not include the document bodies, of which up to
+        `concurrency` are run in parallel on the session's executor.
+
+        If an `IdFilter` is given, it is first updated from the changes feed,
+        and only the IDs that it might contain are looked up on the server.
+
+        :param ids: an iterable of document IDs
+        :param chunk_size: the number of IDs per request
+        :param concurrency: the number of parallel requests, see `Executor`
+        :param id_filter: an `IdFilter` for this database, or `None`
+        :return: an iterator over a boolean for every ID, in the same order
+        :since: 0.10
+        """
+        ids = iter(ids)
+        if id_filter is not None:
+            id_filter.refresh()
+        def _lookup(chunk):
+            found = [False] * len(chunk)
+            positions = [idx for idx, id in enumerate(chunk)
+                         if id_filter is None or id in id_filter]
+            if positions:
+                _, _, data = _call_viewlike(self.resource('_all_docs'), {
+                    'keys': [chunk[idx] for idx in positions]
+                })
+                for idx, row in zip(positions, data['rows']):
+                    # Missing documents have an error, deleted documents are
+                    # flagged in the value
+                    value = row.get('value')
+                    found[idx] = bool(value) and not value.get('deleted')
+            return found
+        chunks = iter(lambda: list(itertools.islice(ids, chunk_size)), [])
+        executor = self.resource.session.executor
+        for found in executor.map(_lookup, chunks, concurrency):
+            for exists in found:
+                yield exists
+
+    def id_filter(self, capacity=1000000, error_rate=0.01):
+        """Return an `IdFilter` loaded with the IDs of all documents in this
+        database.
+
+        :param capacity: the number of IDs the filter is sized for
+        :param error_rate: the probability of false positives when the filter
+                           holds `capacity` IDs
+        :rtype: `IdFilter`
+        :since: 0.10
+        """
+        id_filter = IdFilter(self, capacity, error_rate)
+        id_filter.load()
+        return id_filter
+
+    def loader(self, max_batch=100, delay=0.005):
+        """Return a `BatchLoader` that fetches the documents requested within
+        a short time window from this database with a single request.
+
+        :param max_batch: the maximum number of document IDs per request
+        :param delay: the number of seconds to wait for more IDs before a
+                      batch is fetched
+        :rtype: `BatchLoader`
+        :since: 0.10
+        """
+        return BatchLoader(self, max_batch=max_batch, delay=delay)
+
+    def revisions(self, id, bulk=False, **options):
         """Return all available revisions of the given document.
 
+        By default, every revision is fetched with a separate request. In bulk
+        mode, the revisions are instead fetched with ``open_revs`` requests
+        of up to 100 revisions each, and are parsed incrementally as they
+        arrive.
+
         :param id: the document ID
+        :param bulk: whether to fetch many revisions per request
         :return: an iterator over Document objects, each a different revision,
                  in reverse chronological order, if any were found
         """
@@ -567,13 +852,51 @@ class Database(object):
             return
 
         startrev = data['_revisions']['start']
-        for index, rev in enumerate(data['_revisions']['ids']):
-            options['rev'] = '%d-%s' % (startrev - index, rev)
+        revs = ['%d-%s' % (startrev - index, rev)
+                for index, rev in enumerate(data['_revisions']['ids'])]
+        if bulk:
+            for idx in range(0, len(revs), 100):
+                missing = False
+                for revision in self._open_revs(resource, revs[idx:idx + 100],
+                                                options):
+                    if revision is None:
+                        missing = True
+                        break
+                    yield revision
+                if missing:
+                    return
+            return
+
+        for rev in revs:
+            options['rev'] = rev
             revision = self.get(id, **options)
             if revision is None:
                 return
             yield revision
 
+    def _open_revs(self, resource, revs, options):
+        # Fetch the given revisions with a single request, and yield them in
+        # the same order, up to the first one that is not available anymore
+        # (which is yielded as None)
+        _, _, data = resource.get(headers={'Accept': 'application/json'},
+                                  open_revs=json.encode(revs), **options)
+        arrived = {}
+        try:
+            for item in _iter_json_array(data):
+                if 'ok' in item:
+                    arrived[item['ok']['_rev']] = Document(item['ok'])
+                else:
+                    arrived[item.get('missing')] = None
+                while revs and revs[0] in arrived:
+                    revision = arrived.pop(revs.pop(0))
+                    yield revision
+                    if revision is None:
+                        return
+        finally:
+            data.close()
+        if revs:
+            yield None
+
     def info(self, ddoc=None):
         """Return information about the database or design document as a
         dictionary.
@@ -611,36 +934,144 @@ class Database(object):
         _, _, data = resource.delete_json(filename, rev=doc['_rev'])
         doc['_rev'] = data['rev']
 
-    def get_attachment(self, id_or_doc, filename, default=None):
+    def get_attachment(self, id_or_doc, filename, default=None, dest=None,
+                       progress=None, buffer_size=1024 * 1024, concurrency=1,
+                       range_size=8 * 1024 * 1024):
         """Return an attachment from the specified doc id and filename.
 
+        If `dest` is given, the attachment is instead copied to that file, in
+        blocks of `buffer_size` bytes, and the number of bytes written is
+        returned.
+
+        With a `concurrency` greater than one, attachments larger than
+        `range_size` are downloaded to `dest` as several byte ranges, of which
+        up to `concurrency` are requested in parallel on the session's
+        executor. The file is sized up front and each range is written to its
+        place, through a memory map if `dest` is a path. If the server does
+        not advertise support for ranges, the attachment is downloaded with a
+        single request.
+
         :param id_or_doc: either a document ID or a dictionary or `Document`
                           object representing the document that the attachment
                           belongs to
         :param filename: the name of the attachment file
         :param default: default value to return when the document or attachment
                         is not found
-        :return: a file-like object with read and close methods, or the value
-                 of the `default` argument if the attachment is not found
+        :param dest: the path of a file, or a writable file-like object, to
+                     store the attachment in, or `None`
+        :param progress: a function called as ``progress(done, total)`` after
+                         every block copied to `dest`, where ``total`` is the
+                         size of the attachment if it is known, or `None`
+        :param buffer_size: the size of the blocks copied to `dest`
+        :param concurrency: the number of parallel requests, see `Executor`
+        :param range_size: the number of bytes per range request
+        :return: a file-like object with read and close methods, the number of
+                 bytes written to `dest`, or the value of the `default`
+                 argument if the attachment is not found
         :since: 0.4.1
         """
         if isinstance(id_or_doc, basestring):
             id = id_or_doc
         else:
             id = id_or_doc['_id']
+        resource = _doc_resource(self.resource, id)
         try:
-            _, _, data = _doc_resource(self.resource, id).get(filename)
-            return data
+            if dest is not None and concurrency > 1:
+                # Ask for the identity encoding, as ranges refer to it
+                _, headers, _ = resource.head(filename, headers={
+                    'Accept-Encoding': 'identity'
+                })
+                size = int(headers.get('content-length', 0))
+                if headers.get('accept-ranges') == 'bytes' and \
+                        size > range_size:
+                    return self._get_ranges(resource(filename), headers, dest,
+                                            progress, buffer_size,
+                                            concurrency, range_size)
+            _, headers, data = resource.get(filename)
         except http.ResourceNotFound:
             return default
+        if dest is None:
+            return data
 
-    def put_attachment(self, doc, content, filename=None, content_type=None):
+        total = headers.get('content-length')
+        if total is not None and not headers.get('content-encoding'):
+            total = int(total)
+        else:
+            total = None
+        if isinstance(dest, basestring):
+            fileobj = open(dest, 'wb')
+        else:
+            fileobj = dest
+        try:
+            return _copy_stream(data, fileobj, buffer_size, progress, total)
+        finally:
+            data.close()
+            if fileobj is not dest:
+                fileobj.close()
+
+    def _get_ranges(self, resource, headers, dest, progress, buffer_size,
+                    concurrency, range_size):
+        size = int(headers['content-length'])
+        etag = headers.get('etag')
+        if isinstance(dest, basestring):
+            fileobj = open(dest, 'w+b')
+        else:
+            fileobj = dest
+        target = _RangeTarget(fileobj, size, progress)
+        failed = [] # once a range has failed, the others stop early
+        def _fetch(start):
+            if failed:
+                return
+            try:
+                _fetch_range(start)
+            except:
+                failed.append(True)
+                raise
+        def _fetch_range(start):
+            end = min(start + range_size, size) - 1
+            status, headers, data = resource.get(headers={
+                'Accept-Encoding': 'identity',
+                'Range': 'bytes=%d-%d' % (start, end)
+            })
+            try:
+                if status != 206:
+                    raise http.ServerError((status, 'range not satisfied'))
+                if headers.get('etag') != etag:
+                    raise http.PreconditionFailed(
+                        'attachment changed during download')
+                while start <= end and not failed:
+                    block = data.read(min(buffer_size, end - start + 1))
+                    if not block:
+                        raise http.ServerError((status, 'incomplete range'))
+                    target.write(start, block)
+                    start += len(block)
+            finally:
+                data.close()
+        executor = self.resource.session.executor
+        try:
+            # The pending ranges are waited for if one fails, so that the
+            # target isn't closed while they still write to it
+            for _ in executor.map(_fetch, xrange(0, size, range_size),
+                                  concurrency):
+                pass
+        finally:
+            target.close()
+            if fileobj is not dest:
+                fileobj.close()
+        return size
+
+    def put_attachment(self, doc, content, filename=None, content_type=None,
+                       progress=None):
         """Create or replace an attachment.
 
         Note that the provided `doc` is required to have a ``_rev`` field. Thus,
         if the `doc` is based on a view row, the view row would need to include
         the ``_rev`` field.
 
+        Files of known size (such as regular files, or `StringIO` objects) are
+        sent from their current position with a ``Content-Length`` header,
+        other file-like objects are sent in chunks.
+
         :param doc: the dictionary or `Document` object representing the
                     document that the attachment should be added to
         :param content: the content to upload, either a file-like object or
@@ -651,6 +1082,9 @@ class Database(object):
         :param content_type: content type of the attachment; if omitted, the
                              MIME type is guessed based on the file name
                              extension
+        :param progress: a function called as ``progress(done, total)`` while
+                         a file-like `content` is being sent, where ``total``
+                         is its size if it is known, or `None`
         :since: 0.4.1
         """
         if filename is None:
@@ -663,10 +1097,18 @@ class Database(object):
                 filter(None, mimetypes.guess_type(filename))
             )
 
+        headers = {'Content-Type': content_type}
+        if not isinstance(content, basestring):
+            size = _remaining_size(content)
+            if size is not None:
+                headers['Content-Length'] = str(size)
+            if progress is not None:
+                content = _ProgressReader(content, progress, size)
+
         resource = _doc_resource(self.resource, doc['_id'])
-        status, headers, data = resource.put_json(filename, body=content, headers={
-            'Content-Type': content_type
-        }, rev=doc['_rev'])
+        status, headers, data = resource.put_json(filename, body=content,
+                                                  headers=headers,
+                                                  rev=doc['_rev'])
         doc['_rev'] = data['rev']
 
     def query(self, map_fun, reduce_fun=None, language='javascript',
@@ -712,9 +1154,10 @@ class Database(object):
                              reduce_fun, language=language,
                              wrapper=wrapper)(**options)
 
-    def update(self, documents, **options):
-        """Perform a bulk update or insertion of the given documents using a
-        single HTTP request.
+    def update(self, documents, chunk_size=None, max_bytes=None,
+               concurrency=1, merge=None, merge_attempts=3, **options):
+        """Perform a bulk update or insertion of the given documents using
+        one or more ``_bulk_docs`` requests.
 
         >>> server = Server()
         >>> db = server.create('python-tests')
@@ -742,45 +1185,176 @@ class Database(object):
         to a dictionary. Effectively this means you can also use this method
         with `mapping.Document` objects.
 
+        Large sets of documents can be split into several requests by passing
+        `chunk_size` and/or `max_bytes`. Up to `concurrency` of these requests
+        are sent in parallel, using the session's executor. The results are
+        still returned in the order of `documents`, but note that a failing
+        request does not undo the chunks that were written before.
+
+        Conflicts can be resolved by passing a `merge` function, which is
+        called as ``merge(doc, current)`` for every document that could not
+        be saved due to a conflict, where ``current`` is the latest revision
+        of the document in the database (or `None` if it was deleted). It
+        returns the document to save instead, or `None` to keep the conflict.
+        The latest revisions of all conflicting documents are fetched in bulk,
+        and the merged documents are submitted again with a single bulk
+        update, for up to `merge_attempts` rounds:
+
+        >>> db = server.create('python-tests')
+        >>> db['counter'] = {'count': 1}
+        >>> stale = {'_id': 'counter', 'count': 1}
+        >>> def merge(doc, current):
+        ...     doc['count'] = current['count'] + 1
+        ...     return doc
+        >>> db.update([stale], merge=merge) #doctest: +ELLIPSIS
+        [(True, u'counter', u'2-...')]
+        >>> db['counter']['count']
+        2
+
+        >>> del server['python-tests']
+
         :param documents: a sequence of dictionaries or `Document` objects, or
                           objects providing a ``items()`` method that can be
                           used to convert them to a dictionary
+        :param chunk_size: the maximum number of documents per request, or
+                           `None` for no limit
+        :param max_bytes: the maximum size in bytes of the documents in a
+                          request, or `None` for no limit
+        :param concurrency: the number of parallel requests, see `Executor`
+        :param merge: a function resolving conflicts, or `None`
+        :param merge_attempts: the maximum number of rounds of conflict
+                               resolution
+        :param options: options sent in the body of every request, such as
+                        ``all_or_nothing`` or ``new_edits``
         :return: an iterable over the resulting documents
         :rtype: ``list``
 
         :since: version 0.2
         """
-        docs = []
-        for doc in documents:
-            if isinstance(doc, dict):
-                docs.append(doc)
-            elif hasattr(doc, 'items'):
-                docs.append(dict(doc.items()))
-            else:
-                raise TypeError('expected dict, got %s' % type(doc))
+        if merge is not None:
+            documents = list(documents)
+        chunks = _bulk_chunks(documents, chunk_size, max_bytes)
+        def _update(chunk):
+            return self._update_chunk(chunk[0], chunk[1], options)
+        if concurrency > 1:
+            executor = self.resource.session.executor
+            chunk_results = executor.map(_update, chunks, concurrency)
+        else:
+            chunk_results = itertools.imap(_update, chunks)
+
+        results = []
+        for chunk_result in chunk_results:
+            results.extend(chunk_result)
+
+        if merge is None:
+            return results
+
+        for attempt in range(merge_attempts):
+            conflicts = [idx for idx, (success, id, exc) in enumerate(results)
+                         if isinstance(exc, http.ResourceConflict)]
+            if not conflicts:
+                break
+            current_docs = self.get_many([results[idx][1] for idx in conflicts],
+                                         chunk_size=chunk_size or 100,
+                                         concurrency=concurrency)
+            positions, merged_docs = [], []
+            for idx, current in zip(conflicts, current_docs):
+                # Merge a deep copy, so that the caller's document is only
+                # changed once the merged document has been saved
+                doc = deepcopy(dict(documents[idx].items()))
+                merged = merge(doc, current)
+                if merged is None:
+                    continue
+                merged['_id'] = results[idx][1]
+                if current is not None:
+                    merged['_rev'] = current.rev
+                else:
+                    merged.pop('_rev', None)
+                positions.append(idx)
+                merged_docs.append(merged)
+            if not merged_docs:
+                break
+            merged_results = self.update(merged_docs, chunk_size, max_bytes,
+                                         concurrency, **options)
+            for idx, merged, result in zip(positions, merged_docs,
+                                           merged_results):
+                results[idx] = result
+                doc = documents[idx]
+                if result[0] and isinstance(doc, dict):
+                    doc.clear()
+                    doc.update(merged)
+                    doc.update({'_id': result[1], '_rev': result[2]})
+
+        return results
 
-        content = options
-        content.update(docs=docs)
-        _, _, data = self.resource.post_json('_bulk_docs', body=content)
+    def _update_chunk(self, documents, encoded, options):
+        # Every document is encoded only once, and the request body is put
+        # together from the encoded parts
+        parts = ['%s: %s' % (_encode_utf8(name), _encode_utf8(value))
+                 for name, value in options.items()]
+        parts.append('"docs": [%s]' % ', '.join(encoded))
+        _, _, data = self.resource.post_json('_bulk_docs', headers={
+            'Content-Type': 'application/json'
+        }, body='{%s}' % ', '.join(parts))
 
         results = []
         for idx, result in enumerate(data):
-            if 'error' in result:
-                if result['error'] == 'conflict':
-                    exc_type = http.ResourceConflict
-                else:
-                    # XXX: Any other error types mappable to exceptions here?
-                    exc_type = http.ServerError
-                results.append((False, result['id'],
-                                exc_type(result['reason'])))
-            else:
+            result = _bulk_result(result)
+            if result[0]:
                 doc = documents[idx]
                 if isinstance(doc, dict): # XXX: Is this a good idea??
-                    doc.update({'_id': result['id'], '_rev': result['rev']})
-                results.append((True, result['id'], result['rev']))
+                    doc.update({'_id': result[1], '_rev': result[2]})
+            results.append(result)
 
         return results
 
+    def update_stream(self, documents, **options):
+        """Perform a bulk update or insertion of the documents produced by an
+        iterable, without holding all of them in memory.
+
+        The request is sent right away, using chunked transfer encoding, with
+        each document being encoded as JSON only when the body is read from.
+        The response is parsed incrementally as the returned iterator is
+        consumed, which yields a ``(success, docid, rev_or_exc)`` tuple for
+        every document, in the same order as the documents, as described for
+        `update()`. The connection is released once all results have been
+        read, or when the iterator is closed or garbage collected.
+
+        Unlike `update()`, this method does not store the new ``_id`` and
+        ``_rev`` in the documents, as that would keep all of them alive until
+        the response arrives.
+
+        :param documents: an iterable over dictionaries or `Document` objects,
+                          or objects providing a ``items()`` method that can
+                          be used to convert them to a dictionary
+        :param options: options sent in the body of the request, such as
+                        ``all_or_nothing`` or ``new_edits``
+        :return: an iterator over the results, with a ``close()`` method
+        :since: 0.10
+        """
+        _, _, data = self.resource.post('_bulk_docs', headers={
+            'Content-Type': 'application/json'
+        }, body=_BulkDocsBody(documents, options))
+        return _BulkResults(data)
+
+    def batch_writer(self, max_docs=100, max_bytes=1024 * 1024,
+                     max_delay=1.0):
+        """Return a `BatchWriter` that buffers saved and deleted documents and
+        writes them to this database using bulk updates.
+
+        :param max_docs: the number of buffered documents that triggers a
+                         bulk update
+        :param max_bytes: the total JSON size of buffered documents that
+                          triggers a bulk update
+        :param max_delay: the maximum number of seconds a document stays in
+                          the buffer, or `None` to only write documents when a
+                          limit is reached or the writer is flushed
+        :rtype: `BatchWriter`
+        :since: 0.10
+        """
+        return BatchWriter(self, max_docs=max_docs, max_bytes=max_bytes,
+                           max_delay=max_delay)
+
     def purge(self, docs):
         """Perform purging (complete removing) of the given documents.
 
@@ -946,6 +1520,789 @@ class Database(object):
         return data
 
 
+class BatchLoader(object):
+    """Batches individual document lookups into requests to ``_all_docs``.
+
+    IDs passed to `get()` or `get_async()` are collected for up to `delay`
+    seconds, or until `max_batch` IDs are pending, and are then fetched with
+    a single ``POST _all_docs?include_docs=true`` request:
+
+    >>> server = Server()
+    >>> db = server.create('python-tests')
+    >>> db['foo'] = {'type': 'Foo'}
+    >>> db['bar'] = {'type': 'Bar'}
+    >>> loader = db.loader()
+    >>> foo, bar = loader.get_async('foo'), loader.get_async('bar')
+    >>> foo.result()['type'], bar.result()['type']
+    ('Foo', 'Bar')
+    >>> loader.get('baz', 'missing')
+    'missing'
+
+    >>> del server['python-tests']
+
+    Every caller gets its own `Document` object, even when the same ID was
+    requested more than once. Only the latest revision of a document can be
+    fetched this way; use `Database.get()` for other options.
+
+    :since: 0.10
+    """
+
+    def __init__(self, db, max_batch=100, delay=0.005):
+        self.db = db
+        self.max_batch = max_batch
+        self.delay = delay
+        self.lock = Lock()
+        self._pending = {} # futures keyed by document ID
+        self._timer = None
+
+    def get(self, id, default=None):
+        """Return the document with the specified ID.
+
+        :param id: the document ID
+        :param default: the default value to return when the document is not
+                        found
+        :rtype: `Document`
+        """
+        doc = self.get_async(id).result()
+        if doc is None:
+            return default
+        return doc
+
+    def get_async(self, id):
+        """Request the document with the specified ID as part of the next
+        batch.
+
+        :param id: the document ID
+        :return: a `couchdb.http.Future` for the `Document`, or for `None` if
+                 no document with the ID was found
+        """
+        future = http.Future()
+        batch = None
+        self.lock.acquire()
+        try:
+            self._pending.setdefault(id, []).append(future)
+            if len(self._pending) >= self.max_batch:
+                batch = self._take()
+            elif self._timer is None:
+                self._timer = Timer(self.delay, self.flush)
+                self._timer.setDaemon(True)
+                self._timer.start()
+        finally:
+            self.lock.release()
+        if batch:
+            thread = Thread(target=self._fetch, args=(batch,))
+            thread.setDaemon(True)
+            thread.start()
+        return future
+
+    def flush(self):
+        """Fetch all pending documents right away."""
+        self.lock.acquire()
+        try:
+            batch = self._take()
+        finally:
+            self.lock.release()
+        if batch:
+            self._fetch(batch)
+
+    def _take(self):
+        # Must be called with the lock held.
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        return batch
+
+    def _fetch(self, batch):
+        ids = batch.keys()
+        try:
+            docs = self.db._get_chunk(ids)
+        except:
+            exc_info = sys.exc_info()
+            for futures in batch.values():
+                for future in futures:
+                    future.set_exception(exc_info)
+            return
+        for id, doc in zip(ids, docs):
+            for idx, future in enumerate(batch[id]):
+                if doc is None: # missing or deleted
+                    future.set_result(None)
+                elif idx == 0:
+                    future.set_result(Document(doc))
+                else:
+                    future.set_result(Document(deepcopy(doc)))
+
+
+class BatchWriter(object):
+    """Buffers document writes and sends them to the database in bulk.
+
+    Documents passed to `save()` and `delete()` are written with a single
+    `Database.update()` call once `max_docs` documents or `max_bytes` bytes of
+    JSON are buffered, once the oldest document has been buffered for
+    `max_delay` seconds, or when the writer is flushed. Used as a context
+    manager, the writer is flushed on exit:
+
+    >>> server = Server()
+    >>> db = server.create('python-tests')
+    >>> with db.batch_writer(max_docs=2) as writer:
+    ...     foo = writer.save({'_id': 'foo'})
+    ...     bar = writer.save({'_id': 'bar'})
+    ...     baz = writer.save({'_id': 'baz'})
+    >>> foo.result() #doctest: +ELLIPSIS
+    (True, u'foo', u'1-...')
+    >>> baz.done()
+    True
+
+    >>> del server['python-tests']
+
+    The result of every write is a ``(success, docid, rev_or_exc)`` tuple as
+    returned by `Database.update()`. If the bulk request itself fails, the
+    exception is reported as the result of every document in the batch.
+
+    :since: 0.10
+    """
+
+    def __init__(self, db, max_docs=100, max_bytes=1024 * 1024,
+                 max_delay=1.0):
+        self.db = db
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.lock = Lock()
+        self.flush_lock = Lock() # keeps bulk updates in order
+        self._docs = []
+        self._targets = [] # the non-dict documents the buffered ones copy
+        self._futures = []
+        self._size = 0
+        self._timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def save(self, doc, callback=None):
+        """Buffer a document to be created or updated.
+
+        The ``_id`` and ``_rev`` of the document are updated once it has been
+        written. Documents that are not dictionaries, such as
+        `mapping.Document` objects, are copied when they are buffered, and
+        updated through item assignment.
+
+        :param doc: the document to store
+        :param callback: a function called with the result of the write
+        :return: a `couchdb.http.Future` for the result of the write
+        """
+        target = None
+        if not isinstance(doc, dict):
+            if not hasattr(doc, 'items'):
+                raise TypeError('expected dict, got %s' % type(doc))
+            target, doc = doc, dict(doc.items())
+        size = len(json.encode(doc))
+        future = http.Future()
+        if callback is not None:
+            future.add_done_callback(lambda future: callback(future.result()))
+        flush = False
+        self.lock.acquire()
+        try:
+            self._docs.append(doc)
+            self._targets.append(target)
+            self._futures.append(future)
+            self._size += size
+            if len(self._docs) >= self.max_docs or \
+                    self._size >= self.max_bytes:
+                flush = True
+            elif self._timer is None and self.max_delay is not None:
+                self._timer = Timer(self.max_delay, self.flush)
+                self._timer.setDaemon(True)
+                self._timer.start()
+        finally:
+            self.lock.release()
+        if flush:
+            self.flush()
+        return future
+
+    def delete(self, doc, callback=None):
+        """Buffer the deletion of a document.
+
+        :param doc: a dictionary or `Document` with the ``_id`` and ``_rev``
+                    of the document to delete
+        :param callback: a function called with the result of the write
+        :return: a `couchdb.http.Future` for the result of the write
+        """
+        if doc['_id'] is None:
+            raise ValueError('document ID cannot be None')
+        return self.save({'_id': doc['_id'], '_rev': doc['_rev'],
+                          '_deleted': True}, callback)
+
+    def flush(self):
+        """Write all buffered documents now."""
+        self.flush_lock.acquire()
+        try:
+            self.lock.acquire()
+            try:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                docs, targets = self._docs, self._targets
+                futures = self._futures
+                self._docs, self._targets, self._futures = [], [], []
+                self._size = 0
+            finally:
+                self.lock.release()
+            if not docs:
+                return
+            try:
+                results = self.db.update(docs)
+            except Exception, e:
+                results = [(False, doc.get('_id'), e) for doc in docs]
+        finally:
+            self.flush_lock.release()
+        for target, future, result in zip(targets, futures, results):
+            if target is not None and result[0]:
+                target['_id'] = result[1]
+                target['_rev'] = result[2]
+            future.set_result(result)
+
+
+class IdFilter(object):
+    """Local Bloom filter of the IDs of the documents in a database.
+
+    The filter can tell for certain that a document does not exist, without
+    asking the server; IDs that it might contain still need to be checked,
+    for example with `Database.contains_many()`:
+
+    >>> server = Server()
+    >>> db = server.create('python-tests')
+    >>> db['foo'] = {}
+    >>> id_filter = db.id_filter(capacity=1000)
+    >>> 'foo' in id_filter, 'bar' in id_filter
+    (True, False)
+    >>> db['bar'] = {}
+    >>> list(db.contains_many(['foo', 'bar', 'baz'], id_filter=id_filter))
+    [True, True, False]
+
+    >>> del server['python-tests']
+
+    The filter is filled from ``_all_docs`` by `load()`, and `refresh()` adds
+    the documents created since then according to the changes feed. Deleted
+    documents cannot be removed from a Bloom filter, so they remain false
+    positives. Once more than `capacity` IDs have been added, the rate of
+    false positives exceeds `error_rate`, and a new filter should be built.
+
+    :since: 0.10
+    """
+
+    def __init__(self, db, capacity=1000000, error_rate=0.01):
+        self.db = db
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) /
+                                      math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits * math.log(2) /
+                                           capacity)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0 # number of IDs added
+        self.since = None # update sequence the filter is current with
+        self.lock = Lock()
+
+    def __contains__(self, id):
+        bits = self.bits
+        for idx in self._positions(id):
+            if not bits[idx >> 3] & (1 << (idx & 7)):
+                return False
+        return True
+
+    def add(self, id):
+        """Add a document ID to the filter."""
+        bits = self.bits
+        for idx in self._positions(id):
+            bits[idx >> 3] |= 1 << (idx & 7)
+        self.count += 1
+
+    def load(self):
+        """Add the IDs of all documents in the database."""
+        since = self.db.info()['update_seq']
+        for id in self.db:
+            self.add(id)
+        self.since = since
+
+    def refresh(self, batch=10000):
+        """Add the IDs of documents created since the filter was last loaded
+        or refreshed.
+
+        :param batch: the number of changes to fetch per request
+        """
+        self.lock.acquire()
+        try:
+            if self.since is None:
+                self.load()
+                return
+            while True:
+                data = self.db.changes(since=self.since, limit=batch)
+                for change in data['results']:
+                    if not change.get('deleted'):
+                        self.add(change['id'])
+                self.since = data['last_seq']
+                if len(data['results']) < batch:
+                    break
+        finally:
+            self.lock.release()
+
+    def _positions(self, id):
+        # Derive all bit positions from one digest by double hashing
+        if isinstance(id, unicode):
+            id = id.encode('utf-8')
+        digest = md5(id).hexdigest()
+        first, second = int(digest[:16], 16), int(digest[16:], 16) | 1
+        return [(first + idx * second) % self.num_bits
+                for idx in range(self.num_hashes)]
+
+
+def _copy_stream(src, dest, buffer_size, progress=None, total=None):
+    """Copy a file-like object to another one, and return the number of bytes
+    copied.
+    """
+    readinto = None
+    if hasattr(dest, 'fileno'):
+        # Only real files take the memoryview blocks as they are; other
+        # file-like objects, such as StringIO, would store their repr
+        readinto = getattr(src, 'readinto', None)
+    if readinto is not None:
+        buf = bytearray(buffer_size)
+        view = memoryview(buf)
+    done = 0
+    while True:
+        if readinto is not None:
+            size = readinto(buf)
+            block = view[:size]
+        else:
+            block = src.read(buffer_size)
+            size = len(block)
+        if not size:
+            break
+        dest.write(block)
+        done += size
+        if progress is not None:
+            progress(done, total)
+    return done
+
+
+def _remaining_size(fileobj):
+    """Return the number of bytes that can be read from a file-like object
+    from its current position, or `None` if that cannot be determined.
+    """
+    try:
+        position = fileobj.tell()
+        if hasattr(fileobj, 'fileno'):
+            info = os.fstat(fileobj.fileno())
+            if stat.S_ISREG(info.st_mode): # not for pipes and sockets
+                return info.st_size - position
+        elif hasattr(fileobj, 'getvalue'): # StringIO
+            return len(fileobj.getvalue()) - position
+    except (AttributeError, IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _read_multipart_doc(headers, body):
+    """Read a document from a response that is either JSON or
+    ``multipart/related`` content with the attachments in separate parts.
+    Either way, the ``data`` of the attachments is a file-like object.
+    """
+    mimetype, params = parse_header(headers.get('content-type', ''))
+    if mimetype != 'multipart/related':
+        doc = json.decode(body.read())
+        attachments = doc.get('_attachments') or {}
+        for stub in attachments.values():
+            if 'data' in stub:
+                stub['data'] = StringIO(b64decode(stub['data']))
+        return doc
+    parts = iter(multipart.MultipartReader(body, params['boundary']))
+    _, part = parts.next()
+    text = part.read()
+    doc = json.decode(text)
+    attachments = doc.get('_attachments') or {}
+    names = [name for name in attachments
+             if attachments[name].get('follows')]
+    streams = _AttachmentStreams(parts, body, _stub_order(text, names))
+    for name in names:
+        stub = attachments[name]
+        del stub['follows']
+        stub['data'] = streams.add(name)
+    if not names:
+        streams.finish()
+    return doc
+
+
+def _stub_order(text, names):
+    """Return the names of attachments in the order of their stubs in the
+    JSON text of a document.
+    """
+    start = text.rfind('"_attachments"')
+    def _position(name):
+        key = _encode_utf8(name) + ':'
+        return text.find(key, start)
+    return sorted(names, key=_position)
+
+
+class _AttachmentStreams(object):
+    """The attachment parts of a ``multipart/related`` document response,
+    which are passed to the `_AttachmentStream` they belong to as the
+    response is read.
+    """
+
+    def __init__(self, parts, body, order):
+        self.parts = parts
+        self.body = body
+        self.order = order # names of the parts still to come
+        self.streams = {}
+        self.current = None
+        self.finished = False
+
+    def add(self, name):
+        stream = self.streams[name] = _AttachmentStream(self)
+        return stream
+
+    def advance(self):
+        # Keep whatever is left of the current part, then open the next one
+        if self.current is not None:
+            self.current._spool()
+            self.current = None
+        try:
+            headers, part = self.parts.next()
+        except StopIteration:
+            raise ValueError('attachment missing from multipart response')
+        # Parts are matched by their file name if the server sends one, and
+        # by their order otherwise
+        _, params = parse_header(headers.get('content-disposition', ''))
+        name = params.get('filename')
+        if isinstance(name, str):
+            name = name.decode('utf-8')
+        if name not in self.order:
+            name = self.order[0]
+        self.order.remove(name)
+        self.current = self.streams[name]
+        self.current._open(part, headers.get('content-encoding'))
+
+    def part_done(self, stream):
+        # Called when a stream has been read to its end, or closed. Once no
+        # stream needs more of the response, the rest of it is skipped.
+        if stream is self.current:
+            self.current = None
+        if self.current is None:
+            for name in self.order:
+                if not self.streams[name].closed:
+                    return
+            self.finish()
+
+    def finish(self):
+        # Read up to the end of the response, which releases the connection
+        if not self.finished:
+            self.finished = True
+            for _ in self.parts:
+                pass
+            self.body.close()
+
+
+class _AttachmentStream(object):
+    """File-like object for an attachment in a ``multipart/related`` document
+    response, which is read from the response when needed.
+    """
+
+    def __init__(self, streams):
+        self.streams = streams
+        self.fileobj = None
+        self.decoder = None
+        self.closed = False
+        self._buffer = ''
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        if size is None:
+            size = -1
+        while self.fileobj is None:
+            self.streams.advance()
+        data, at_end = self._read(size)
+        if at_end:
+            self.streams.part_done(self)
+        return data
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.streams.part_done(self)
+
+    def _open(self, part, encoding):
+        self.fileobj = part
+        if encoding == 'gzip':
+            self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def _spool(self):
+        # Called before the response moves on to the next part
+        data = ''
+        if not self.closed:
+            data = self._read(-1)[0]
+        self.fileobj = StringIO(data)
+        self.decoder = None
+
+    def _read(self, size):
+        if self.decoder is None:
+            data = self.fileobj.read(size)
+            return data, size < 0 or len(data) < size
+        data = self._buffer
+        while self.decoder is not None and (size < 0 or len(data) < size):
+            raw = self.fileobj.read(multipart.BLOCK_SIZE)
+            if raw:
+                data += self.decoder.decompress(raw)
+            else:
+                data += self.decoder.flush()
+                self.decoder = None
+        if size < 0:
+            self._buffer = ''
+        else:
+            data, self._buffer = data[:size], data[size:]
+        if self.decoder is None and self._buffer:
+            # Decoding has finished, serve the rest from memory
+            self.fileobj, self._buffer = StringIO(self._buffer), ''
+            return data, False
+        return data, self.decoder is None
+
+
+class _RangeTarget(object):
+    """Destination of a download in byte ranges, which are written to their
+    offset in a file from several threads.
+
+    Real files are extended to their final size up front. If the file can be
+    memory mapped, the ranges are copied into the map, otherwise each block is
+    written to the file while holding a lock.
+    """
+
+    def __init__(self, fileobj, size, progress=None):
+        self.fileobj = fileobj
+        self.size = size
+        self.progress = progress
+        self.done = 0
+        self.lock = Lock()
+        self.offset = fileobj.tell()
+        self.map = None
+        if hasattr(fileobj, 'fileno'):
+            fileobj.truncate(self.offset + size)
+            if self.offset == 0 and size:
+                try:
+                    fileobj.flush()
+                    self.map = mmap.mmap(fileobj.fileno(), size)
+                except (EnvironmentError, ValueError): # not readable
+                    pass
+
+    def write(self, position, data):
+        if self.map is not None:
+            self.map[position:position + len(data)] = data
+        self.lock.acquire()
+        try:
+            if self.map is None:
+                self.fileobj.seek(self.offset + position)
+                self.fileobj.write(data)
+            self.done += len(data)
+            if self.progress is not None:
+                self.progress(self.done, self.size)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.fileobj.seek(self.offset + self.size)
+
+
+class _ProgressReader(object):
+    """File-like wrapper that reports how much has been read."""
+
+    def __init__(self, fileobj, callback, total=None):
+        self.fileobj = fileobj
+        self.callback = callback
+        self.total = total
+        self.done = 0
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if data:
+            self.done += len(data)
+            self.callback(self.done, self.total)
+        return data
+
+    def seek(self, offset, whence=0):
+        # Called when a request is retried, which starts over
+        self.done = 0
+        return self.fileobj.seek(offset, whence)
+
+
+def _encode_utf8(obj):
+    """Encode an object as JSON in UTF-8."""
+    data = json.encode(obj)
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return data
+
+
+def _encode_doc(doc):
+    """Encode a document for a bulk update."""
+    if isinstance(doc, dict):
+        return _encode_utf8(doc)
+    elif hasattr(doc, 'items'):
+        return _encode_utf8(dict(doc.items()))
+    raise TypeError('expected dict, got %s' % type(doc))
+
+
+def _bulk_result(result):
+    """Convert an item of a bulk update response to a ``(success, docid,
+    rev_or_exc)`` tuple.
+    """
+    if 'error' in result:
+        if result['error'] == 'conflict':
+            exc_type = http.ResourceConflict
+        else:
+            # XXX: Any other error types mappable to exceptions here?
+            exc_type = http.ServerError
+        return False, result['id'], exc_type(result['reason'])
+    return True, result['id'], result['rev']
+
+
+def _bulk_chunks(documents, chunk_size=None, max_bytes=None):
+    """Split documents into chunks for bulk updates, yielding a list of the
+    documents and a list of their JSON encodings for every chunk.
+    """
+    chunk, encoded, size = [], [], 0
+    for doc in documents:
+        data = _encode_doc(doc)
+        if chunk and (chunk_size is not None and len(chunk) >= chunk_size or
+                      max_bytes is not None and size + len(data) > max_bytes):
+            yield chunk, encoded
+            chunk, encoded, size = [], [], 0
+        chunk.append(doc)
+        encoded.append(data)
+        size += len(data)
+    if chunk:
+        yield chunk, encoded
+
+
+class _BulkDocsBody(object):
+    """File-like request body for a bulk update that encodes the documents as
+    it is being read.
+    """
+
+    def __init__(self, documents, options):
+        self._parts = self._generate(documents, options)
+        self._buffer = []
+        self._size = 0
+
+    def read(self, size=-1):
+        while size < 0 or self._size < size:
+            try:
+                part = self._parts.next()
+            except StopIteration:
+                break
+            self._buffer.append(part)
+            self._size += len(part)
+        data = ''.join(self._buffer)
+        if size < 0 or len(data) <= size:
+            self._buffer, self._size = [], 0
+            return data
+        self._buffer, self._size = [data[size:]], len(data) - size
+        return data[:size]
+
+    def _generate(self, documents, options):
+        yield '{'
+        for name, value in options.items():
+            yield '%s: %s, ' % (_encode_utf8(name), _encode_utf8(value))
+        yield '"docs": ['
+        for idx, doc in enumerate(documents):
+            if idx:
+                yield ', '
+            yield _encode_doc(doc)
+        yield ']}'
+
+
+_JSON_STRUCTURE = re.compile(r'["{}\[\]]')
+_JSON_STRING_END = re.compile(r'["\\]')
+
+class _BulkResults(object):
+    """Iterator over the results of a bulk update, parsed from the response
+    as they are requested.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._results = _iter_json_array(data)
+
+    def __iter__(self):
+        return self
+
+    def __del__(self):
+        self.close()
+
+    def next(self):
+        try:
+            return _bulk_result(self._results.next())
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        data, self.data = self.data, None
+        if data is not None:
+            data.close()
+
+
+def _iter_json_array(fileobj):
+    """Incrementally decode the elements of a JSON array of objects or arrays
+    read from a file-like object.
+    """
+    buf, pos, start = '', 0, 0
+    depth, in_string = 0, False
+    while True:
+        chunk = fileobj.read(http.CHUNK_SIZE)
+        if not chunk:
+            break
+        buf += chunk
+        while True:
+            if in_string:
+                match = _JSON_STRING_END.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(buf): # need the escaped character
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                in_string = False
+                pos = match.end()
+                continue
+            match = _JSON_STRUCTURE.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            char, pos = match.group(), match.end()
+            if char == '"':
+                in_string = True
+            elif char in '{[':
+                depth += 1
+                if depth == 2:
+                    start = match.start()
+            else:
+                depth -= 1
+                if depth == 1:
+                    yield json.decode(buf[start:pos])
+                    buf, pos = buf[pos:], 0
+
+
 def _doc_resource(base, doc_id):
     """Return the resource for the given document id.
     """
@@ -12,9 +12,11 @@ standard library.
 """
 
 from base64 import b64encode
-from datetime import datetime
+from collections import deque
 import errno
+from select import error as select_error, select
 from httplib import BadStatusLine, HTTPConnection, HTTPSConnection
+import random
 import socket
 import time
 try:
@@ -23,18 +25,21 @@ except ImportError:
     from StringIO import StringIO
 import sys
 try:
-    from threading import Lock
+    from threading import Condition, Lock, Thread, local
 except ImportError:
-    from dummy_threading import Lock
+    from dummy_threading import Condition, Lock, Thread, local
+from Queue import Queue
 import urllib
 from urlparse import urlsplit, urlunsplit
-from email.Utils import parsedate
+import zlib
 
 from couchdb import json
 
 __all__ = ['HTTPError', 'PreconditionFailed', 'ResourceNotFound',
            'ResourceConflict', 'ServerError', 'Unauthorized', 'RedirectLimit',
-           'Session', 'Resource']
+           'CircuitOpen', 'Timeout', 'Session', 'Resource', 'Future',
+           'Executor', 'RetryPolicy', 'BackoffRetryPolicy', 'CircuitBreaker',
+           'RequestStats', 'ClusterSession']
 __docformat__ = 'restructuredtext en'
 
 
@@ -163,42 +168,408 @@ class RedirectLimit(Exception):
     """
 
 
+class CircuitOpen(Exception):
+    """Exception raised instead of sending a request to a host that the
+    session's `CircuitBreaker` considers to be unavailable.
+    """
+
+
+class Timeout(Exception):
+    """Exception raised when waiting for the result of a `Future`, or for a
+    connection from a `ConnectionPool` that has reached its size limit, takes
+    longer than the given timeout.
+    """
+
+
 CHUNK_SIZE = 1024 * 8
+SEND_BLOCK_SIZE = 1024 * 64 # for request bodies of known length
 
 class ResponseBody(object):
 
-    def __init__(self, resp, callback):
+    def __init__(self, resp, callback, discard=None, decoder=None):
         self.resp = resp
         self.callback = callback
+        self.discard = discard
+        self.decoder = decoder
+        self.bytes_read = 0 # raw bytes received, before decompression
+        self._buffer = ''
+        self._tee = None
+
+    def tee(self, limit, callback):
+        """Collect the body while it is being read, and pass it to `callback`
+        as a string once it has been read completely. Collecting stops as soon
+        as the body turns out to be larger than `limit` bytes.
+        """
+        self._tee = []
+        self._tee_size = 0
+        self._tee_limit = limit
+        self._tee_callback = callback
 
     def read(self, size=None):
-        bytes = self.resp.read(size)
+        try:
+            if self.decoder is None:
+                bytes = self.resp.read(size)
+                self.bytes_read += len(bytes)
+            else:
+                bytes = self._read_decoded(size)
+        except:
+            self._abort()
+            raise
+        self._collect(bytes)
         if size is None or len(bytes) < size:
             self.close()
         return bytes
 
     def close(self):
-        while not self.resp.isclosed():
-            self.resp.read(CHUNK_SIZE)
+        if self._tee is not None:
+            # Decoded data that has not been returned by read() yet
+            self._collect(self._buffer)
+            self._buffer = ''
+        try:
+            drained = False
+            while not self.resp.isclosed():
+                bytes = self.resp.read(CHUNK_SIZE)
+                self.bytes_read += len(bytes)
+                drained = True
+                if self._tee is not None:
+                    self._collect(self._decode(bytes))
+            if drained and self._tee is not None and self.decoder is not None:
+                self._collect(self.decoder.flush())
+        except:
+            self._abort()
+            raise
+        self._complete()
         if self.callback:
             self.callback()
             self.callback = None
 
-    def iterchunks(self):
+    def readinto(self, buffer):
+        """Read up to ``len(buffer)`` bytes into the given writable buffer
+        (for example a ``bytearray`` or ``memoryview``).
+
+        :return: the number of bytes read, 0 at the end of the body
+        """
+        bytes = self.read(len(buffer))
+        size = len(bytes)
+        buffer[:size] = bytes
+        return size
+
+    def iterchunks(self, max_line_length=None):
+        """Iterate over the lines of a chunked response as they arrive.
+
+        Lines are split on line feeds, with any trailing carriage return
+        removed, regardless of how they are spread across HTTP chunks.
+
+        :param max_line_length: the maximum length of a single line, or `None`
+                                for no limit
+        :raise ValueError: if a line exceeds `max_line_length`
+        """
         assert self.resp.msg.get('transfer-encoding') == 'chunked'
-        while True:
+        buf = bytearray()
+        done = False
+        while not done:
             if self.resp.isclosed():
                 break
-            chunksz = int(self.resp.fp.readline().strip(), 16)
-            if not chunksz:
-                self.resp.fp.read(2) #crlf
-                self.resp.close()
-                self.callback()
+            try:
+                chunksz = int(self.resp.fp.readline().strip(), 16)
+                if chunksz:
+                    chunk = self._decode(self.resp.fp.read(chunksz))
+                    self.resp.fp.read(2) #crlf
+                    self.bytes_read += chunksz
+                else:
+                    self.resp.fp.read(2) #crlf
+                    self.resp.close()
+                    # Whatever the decoder still holds
+                    chunk = self._decode('')
+                    done = True
+            except:
+                self._abort()
+                raise
+            self._collect(chunk)
+            if done:
+                self._complete()
+                if self.callback:
+                    self.callback()
+                    self.callback = None
+            buf.extend(chunk)
+            start = 0
+            while True:
+                end = buf.find('\n', start)
+                if end < 0:
+                    break
+                stop = end
+                if stop > start and buf[stop - 1] == 13: # '\r'
+                    stop -= 1
+                if max_line_length is not None and \
+                        stop - start > max_line_length:
+                    break
+                yield memoryview(buf)[start:stop].tobytes()
+                start = end + 1
+            if start:
+                del buf[:start]
+            if max_line_length is not None and len(buf) > max_line_length:
+                self._abort()
+                raise ValueError('line exceeds maximum length of %d bytes'
+                                 % max_line_length)
+        if buf:
+            if buf[-1] == 13: # '\r'
+                del buf[-1]
+            yield str(buf)
+
+    def _decode(self, bytes):
+        if self.decoder is None:
+            return bytes
+        if not bytes:
+            return self.decoder.flush()
+        return self.decoder.decompress(bytes)
+
+    def _read_decoded(self, size):
+        # Decompress whole raw chunks and keep any surplus for the next call.
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size is None or length < size:
+            if size is None:
+                bytes = self.resp.read()
+            else:
+                bytes = self.resp.read(CHUNK_SIZE)
+            self.bytes_read += len(bytes)
+            bytes = self._decode(bytes)
+            parts.append(bytes)
+            length += len(bytes)
+            if self.resp.isclosed():
+                bytes = self.decoder.flush()
+                parts.append(bytes)
+                length += len(bytes)
                 break
-            chunk = self.resp.fp.read(chunksz)
-            for ln in chunk.splitlines():
-                yield ln
-            self.resp.fp.read(2) #crlf
+        data = ''.join(parts)
+        if size is None:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def _collect(self, bytes):
+        if self._tee is not None and bytes:
+            self._tee_size += len(bytes)
+            if self._tee_size > self._tee_limit:
+                self._tee = None
+            else:
+                self._tee.append(bytes)
+
+    def _complete(self):
+        if self._tee is not None:
+            body, self._tee = ''.join(self._tee), None
+            self._tee_callback(body)
+
+    def _abort(self):
+        # After a failed read the connection is in an undefined state, so it
+        # is discarded instead of being returned to the pool.
+        self._tee = None
+        self.resp.close()
+        if self.callback:
+            self.callback = None
+            if self.discard:
+                self.discard()
+
+
+class Future(object):
+    """The pending result of a call that is running on an `Executor`.
+
+    :since: 0.10
+    """
+
+    def __init__(self):
+        self._condition = Condition(Lock())
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        """Return whether the call has completed, successfully or not."""
+        return self._done
+
+    def result(self, timeout=None):
+        """Return the value returned by the call, waiting for it to complete
+        if necessary. If the call raised an exception, that exception is
+        re-raised here.
+
+        :param timeout: number of seconds to wait, or `None` to wait forever
+        :raise Timeout: if the call did not complete within `timeout` seconds
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Return the exception raised by the call, or `None` if the call
+        completed successfully.
+
+        :param timeout: number of seconds to wait, or `None` to wait forever
+        :raise Timeout: if the call did not complete within `timeout` seconds
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+
+    def add_done_callback(self, fn):
+        """Arrange for ``fn(future)`` to be called when the call completes. If
+        it has already completed, `fn` is called immediately.
+        """
+        self._condition.acquire()
+        try:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        finally:
+            self._condition.release()
+        fn(self)
+
+    def set_result(self, result):
+        """Mark the future as completed with the given result."""
+        self._set(result, None)
+
+    def set_exception(self, exc_info=None):
+        """Mark the future as failed.
+
+        :param exc_info: a ``(type, value, traceback)`` tuple, or `None` to use
+                         the exception currently being handled
+        """
+        if exc_info is None:
+            exc_info = sys.exc_info()
+        self._set(None, exc_info)
+
+    def _set(self, result, exc_info):
+        self._condition.acquire()
+        try:
+            self._result, self._exc_info = result, exc_info
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        for fn in callbacks:
+            fn(self)
+
+    def _wait(self, timeout):
+        self._condition.acquire()
+        try:
+            if timeout is None:
+                while not self._done:
+                    self._condition.wait()
+            else:
+                deadline = time.time() + timeout
+                while not self._done:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Timeout('call did not complete within %s '
+                                      'seconds' % timeout)
+                    self._condition.wait(remaining)
+        finally:
+            self._condition.release()
+
+
+class Executor(object):
+    """Runs calls on a bounded pool of worker threads.
+
+    Workers are started on demand, up to `max_workers` of them; calls
+    submitted while all workers are busy are queued until one becomes
+    available. Every call occupies a worker thread while its requests are in
+    flight, so the number of concurrent requests is bounded by `max_workers`,
+    which has to be raised accordingly to keep many requests in flight.
+
+    The `Database` methods that take a `concurrency` argument send their
+    requests through `map()` on the session's executor, so they run at most
+    `max_workers` requests in parallel, and one after the other when called
+    from a worker thread.
+
+    >>> executor = Executor(max_workers=2)
+    >>> executor.submit(sum, [1, 2, 3]).result()
+    6
+    >>> list(executor.map(abs, [-1, -2, -3]))
+    [1, 2, 3]
+
+    :since: 0.10
+    """
+
+    def __init__(self, max_workers=10):
+        self.max_workers = max_workers
+        self.queue = Queue()
+        self.lock = Lock()
+        self.workers = 0
+        self.idle = 0
+        self.local = local()
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule ``fn(*args, **kwargs)`` to be run by a worker thread.
+
+        :return: a `Future` for the result of the call
+        """
+        future = Future()
+        self.lock.acquire()
+        try:
+            self.queue.put((future, fn, args, kwargs))
+            if self.idle:
+                self.idle -= 1
+            elif self.workers < self.max_workers:
+                self.workers += 1
+                worker = Thread(target=self._work)
+                worker.setDaemon(True)
+                worker.start()
+        finally:
+            self.lock.release()
+        return future
+
+    def map(self, fn, iterable, concurrency=None):
+        """Call `fn` for every item in `iterable` and yield the results in
+        order.
+
+        The iterable is consumed lazily: at most `concurrency` calls (by
+        default `max_workers`) are pending at any time.
+
+        When called from one of the executor's own worker threads, the calls
+        are made one after the other in that thread, as waiting for other
+        workers could otherwise deadlock once all of them are busy.
+
+        If a call fails, or the iteration is stopped early, the calls that are
+        still pending are waited for before the iteration ends, so that none
+        of them outlives it.
+        """
+        if getattr(self.local, 'worker', False):
+            for item in iterable:
+                yield fn(item)
+            return
+        if concurrency is None:
+            concurrency = self.max_workers
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(self.submit(fn, item))
+                if len(pending) >= concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            while pending:
+                pending.popleft().exception()
+
+    def _work(self):
+        self.local.worker = True
+        while True:
+            future, fn, args, kwargs = self.queue.get()
+            try:
+                result = fn(*args, **kwargs)
+            except:
+                future.set_exception()
+            else:
+                future.set_result(result)
+            del future, fn, args, kwargs
+            self.lock.acquire()
+            try:
+                self.idle += 1
+            finally:
+                self.lock.release()
 
 
 RETRYABLE_ERRORS = frozenset([
@@ -208,41 +579,393 @@ RETRYABLE_ERRORS = frozenset([
     errno.ENETRESET, errno.ENETUNREACH, errno.ENETDOWN
 ])
 
+RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+
+class RetryPolicy(object):
+    """Decides whether a failed request is retried, and after what delay.
+
+    This is the policy used by default: a request that failed with one of the
+    `retryable_errors` socket errors is retried after each of the given
+    `delays` in turn, whatever its method. Responses are never retried.
+
+    Subclasses can override `delay()` and `started()` to implement other
+    strategies, see `BackoffRetryPolicy`.
+
+    :since: 0.10
+    """
+
+    def __init__(self, delays=[0], retryable_errors=RETRYABLE_ERRORS):
+        self.delays = list(delays)
+        self.retryable_errors = set(retryable_errors)
+
+    def started(self, method):
+        """Called once for every request, before it is first sent."""
+
+    def delay(self, method, attempt, error=None, status=None):
+        """Return the number of seconds to wait before retrying a request, or
+        `None` if it should not be retried.
+
+        :param method: the HTTP method of the request
+        :param attempt: the number of retries made so far
+        :param error: the `socket.error` the attempt failed with, if any
+        :param status: the HTTP status of the response, if one was received
+        """
+        if error is None or not error.args or \
+                error.args[0] not in self.retryable_errors:
+            return None
+        if attempt < len(self.delays):
+            return self.delays[attempt]
+        return None
+
+
+class BackoffRetryPolicy(RetryPolicy):
+    """Retry policy with exponential backoff, jitter and a retry budget.
+
+    Idempotent requests are retried on retryable socket errors and on
+    responses with one of the `retryable_statuses` (such as 503 or 429).
+    Other requests are only retried if the connection was refused, as the
+    request then never reached the server.
+
+    The delay before retry number ``n`` is picked at random between zero
+    and ``min(max_delay, base_delay * 2 ** n)``. To keep retries from
+    overloading a struggling server, every request adds `budget` to a pool of
+    retry tokens (capped at `max_tokens`), and every retry spends one token.
+    With the default budget of 0.2, retries add at most 20% to the request
+    rate once the initial reserve has been used up.
+
+    :since: 0.10
+    """
+
+    def __init__(self, max_retries=3, base_delay=0.05, max_delay=5.0,
+                 budget=0.2, max_tokens=10, methods=IDEMPOTENT_METHODS,
+                 retryable_errors=RETRYABLE_ERRORS,
+                 retryable_statuses=RETRYABLE_STATUSES):
+        RetryPolicy.__init__(self, retryable_errors=retryable_errors)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.max_tokens = self.tokens = max_tokens
+        self.methods = set(methods)
+        self.retryable_statuses = set(retryable_statuses)
+        self.lock = Lock()
+
+    def started(self, method):
+        self.lock.acquire()
+        try:
+            self.tokens = min(self.max_tokens, self.tokens + self.budget)
+        finally:
+            self.lock.release()
+
+    def delay(self, method, attempt, error=None, status=None):
+        if attempt >= self.max_retries:
+            return None
+        if error is not None:
+            if not error.args or error.args[0] not in self.retryable_errors:
+                return None
+            if method not in self.methods and \
+                    error.args[0] != errno.ECONNREFUSED:
+                return None
+        elif status not in self.retryable_statuses or \
+                method not in self.methods:
+            return None
+        self.lock.acquire()
+        try:
+            if self.tokens < 1:
+                return None
+            self.tokens -= 1
+        finally:
+            self.lock.release()
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """Makes requests to a failing host fail fast.
+
+    After `threshold` consecutive failures (socket errors or 5xx responses)
+    the circuit for a host opens, and requests to it immediately raise
+    `CircuitOpen`. Once `reset_timeout` seconds have passed, a single trial
+    request is let through: if it succeeds the circuit closes again,
+    otherwise it stays open for another `reset_timeout` seconds.
+
+    :since: 0.10
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = {} # consecutive failures keyed by (scheme, host)
+        self.opened = {} # time the circuit was opened, keyed by (scheme, host)
+        self.lock = Lock()
+
+    def before(self, url):
+        """Check whether a request to `url` may be sent.
+
+        :raise CircuitOpen: if the circuit for the host is open
+        """
+        key = _pool_key(url)
+        self.lock.acquire()
+        try:
+            opened = self.opened.get(key)
+            if opened is None:
+                return
+            if time.time() - opened < self.reset_timeout:
+                raise CircuitOpen('%s://%s is unavailable' % key)
+            # Let a single trial request through, and hold off everyone
+            # else until it has completed.
+            self.opened[key] = time.time()
+        finally:
+            self.lock.release()
+
+    def is_open(self, url):
+        """Return whether requests to `url` currently fail fast."""
+        opened = self.opened.get(_pool_key(url))
+        return opened is not None and \
+            time.time() - opened < self.reset_timeout
+
+    def success(self, url):
+        key = _pool_key(url)
+        self.lock.acquire()
+        try:
+            self.failures.pop(key, None)
+            self.opened.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def failure(self, url):
+        key = _pool_key(url)
+        self.lock.acquire()
+        try:
+            failures = self.failures.get(key, 0) + 1
+            self.failures[key] = failures
+            if failures >= self.threshold:
+                self.opened[key] = time.time()
+        finally:
+            self.lock.release()
+
+
+class RequestStats(object):
+    """Measurements of a single request, as reported to the hooks of a
+    `Session`.
+
+    Timings are in seconds: `pool_wait` is the time spent waiting for a
+    connection from the pool, `connect` the time spent establishing new
+    connections, `ttfb` the time from sending the request until the response
+    headers arrived, and `body_read` the time from then until the body was
+    read completely (for streamed bodies, until it was closed).
+
+    :since: 0.10
+    """
+
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.status = None
+        self.error = None # the exception raised, if any
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.cache_hit = False # whether a conditional request was sent
+        self.not_modified = False # whether the cached response was served
+        self.pool_wait = self.connect = self.ttfb = self.body_read = 0.0
+
+    @property
+    def url_template(self):
+        """The URL path with database names, document IDs and other names
+        replaced by placeholders, such as ``/{db}/_design/{ddoc}/_view/{view}``.
+        """
+        return url_template(self.url)
+
+    @property
+    def duration(self):
+        """The total time taken by the request."""
+        return self.pool_wait + self.connect + self.ttfb + self.body_read
+
 
 class Session(object):
 
     def __init__(self, cache=None, timeout=None, max_redirects=5,
-                 retry_delays=[0], retryable_errors=RETRYABLE_ERRORS):
+                 retry_delays=[0], retryable_errors=RETRYABLE_ERRORS,
+                 max_workers=10, max_connections=None, pool_timeout=None,
+                 idle_timeout=None, prewarm=None, cache_streamed=None,
+                 accept_gzip=False, gzip_threshold=None, retry_policy=None,
+                 circuit_breaker=None, hooks=None, coalesce=False):
         """Initialize an HTTP client session.
 
-        :param cache: an instance with a dict-like interface or None to allow
-                      Session to create a dict for caching.
+        :param cache: a `Cache` instance, an instance with a dict-like
+                      interface for the cache to store responses in, or None
+                      to allow Session to create a default `Cache`.
         :param timeout: socket timeout in number of seconds, or `None` for no
                         timeout (the default)
-        :param retry_delays: list of request retry delays.
+        :param retry_delays: list of request retry delays, used unless a
+                             `retry_policy` is given
+        :param retryable_errors: socket error numbers that cause a retry,
+                                 used unless a `retry_policy` is given
+        :param max_workers: maximum number of worker threads used to run
+                            calls passed to `submit()`, and thus the maximum
+                            number of such calls running at the same time
+        :param max_connections: maximum number of connections per host, or
+                                `None` for no limit (the default)
+        :param pool_timeout: number of seconds to wait for a connection when
+                             `max_connections` has been reached, or `None` to
+                             wait forever (the default)
+        :param idle_timeout: number of seconds after which idle connections
+                             are closed instead of reused, or `None` to keep
+                             them (the default)
+        :param prewarm: a dictionary mapping URLs to the number of connections
+                        that should be opened to their host right away
+        :param cache_streamed: maximum size in bytes of streamed (large or
+                               chunked) response bodies that are stored in the
+                               cache while the caller reads them, or `None` to
+                               only cache small, buffered responses (the
+                               default)
+        :param accept_gzip: whether to ask the server for gzip-compressed
+                            responses; compressed responses are decoded
+                            transparently
+        :param gzip_threshold: size in bytes from which JSON request bodies
+                               are sent gzip-compressed, or `None` to never
+                               compress request bodies (the default)
+        :param retry_policy: a `RetryPolicy` deciding which failed requests
+                             are retried
+        :param circuit_breaker: a `CircuitBreaker` to fail requests to
+                                unavailable hosts fast, or `None`
+        :param hooks: a list of callables that are called with a
+                      `RequestStats` object once a request has completed
+        :param coalesce: whether concurrent GET requests for the same URL,
+                         credentials and headers should share a single
+                         request; the response body is then buffered in
+                         memory, so feeds, ranged requests and requests for
+                         other formats than JSON are never coalesced
         """
         from couchdb import __version__ as VERSION
         self.user_agent = 'CouchDB-Python/%s' % VERSION
-        # XXX We accept a `cache` dict arg, but the ref gets overwritten later
-        # during cache cleanup. Do we remove the cache arg (does using a shared
-        # Session instance cover the same use cases?) or fix the cache cleanup?
-        # For now, let's just assign the dict to the Cache instance to retain
-        # current behaviour.
-        if cache is not None:
-            cache_by_url = cache
-            cache = Cache()
-            cache.by_url = cache_by_url
-        else:
+        if cache is None:
             cache = Cache()
+        elif not isinstance(cache, Cache):
+            cache = Cache(by_url=cache)
         self.cache = cache
+        self.cache_streamed = cache_streamed
+        self.accept_gzip = accept_gzip
+        self.gzip_threshold = gzip_threshold
         self.max_redirects = max_redirects
         self.perm_redirects = {}
-        self.connection_pool = ConnectionPool(timeout)
-        self.retry_delays = list(retry_delays) # We don't want this changing on us.
-        self.retryable_errors = set(retryable_errors)
+        self.connection_pool = ConnectionPool(timeout,
+                                              max_size=max_connections,
+                                              wait_timeout=pool_timeout,
+                                              idle_timeout=idle_timeout)
+        if prewarm:
+            for url, count in prewarm.items():
+                self.connection_pool.prewarm(url, count)
+        if retry_policy is None:
+            retry_policy = RetryPolicy(retry_delays, retryable_errors)
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.hooks = list(hooks or [])
+        self.coalesce = coalesce
+        self.in_flight = {} # futures of coalesced requests keyed by request
+        self.in_flight_lock = Lock()
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = Lock()
+
+    def _get_retry_delays(self):
+        return self.retry_policy.delays
+    def _set_retry_delays(self, delays):
+        self.retry_policy.delays = list(delays)
+    retry_delays = property(_get_retry_delays, _set_retry_delays,
+                            doc='The retry delays of the retry policy')
+
+    def _get_retryable_errors(self):
+        return self.retry_policy.retryable_errors
+    def _set_retryable_errors(self, errors):
+        self.retry_policy.retryable_errors = set(errors)
+    retryable_errors = property(_get_retryable_errors, _set_retryable_errors,
+                                doc='The socket errors retried by the retry '
+                                    'policy')
+
+    @property
+    def executor(self):
+        """The `Executor` used to run calls passed to `submit()`, created on
+        first use.
+        """
+        if self._executor is None:
+            self._executor_lock.acquire()
+            try:
+                if self._executor is None:
+                    self._executor = Executor(self.max_workers)
+            finally:
+                self._executor_lock.release()
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on one of the session's worker threads
+        and return a `Future` for its result.
+
+        Any call that ends up making requests through this session can be
+        submitted, for example ``session.submit(db.get, doc_id)``, so that
+        several requests can be in flight at the same time while sharing the
+        session's connection pool and cache. The calls run on the session's
+        `executor`, with at most `max_workers` of them at the same time, as
+        described for `Executor`.
+
+        :return: a `Future`
+        :since: 0.10
+        """
+        return self.executor.submit(fn, *args, **kwargs)
 
     def request(self, method, url, body=None, headers=None, credentials=None,
                 num_redirects=0):
+        if self.coalesce and _is_plain_get(method.upper(), url, body,
+                                           headers):
+            key = (url, credentials, tuple(sorted((headers or {}).items())))
+            return self._coalesced(key, method, url, headers, credentials,
+                                   num_redirects)
+        return self._request(method, url, body, headers, credentials,
+                             num_redirects)
+
+    def _coalesced(self, key, method, url, headers, credentials,
+                   num_redirects):
+        # Only the first caller for a given key sends the request, the others
+        # wait for its result. Every caller gets its own copy of the body.
+        self.in_flight_lock.acquire()
+        try:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+        finally:
+            self.in_flight_lock.release()
+
+        if leader:
+            try:
+                try:
+                    status, msg, data = self._request(method, url, None,
+                                                      headers, credentials,
+                                                      num_redirects)
+                    if data is not None:
+                        data = data.read()
+                finally:
+                    self.in_flight_lock.acquire()
+                    try:
+                        del self.in_flight[key]
+                    finally:
+                        self.in_flight_lock.release()
+            except:
+                future.set_exception()
+                raise
+            future.set_result((status, msg, data))
+
+        status, msg, data = future.result()
+        if data is not None:
+            data = StringIO(data)
+        return status, msg, data
+
+    def _request(self, method, url, body=None, headers=None, credentials=None,
+                 num_redirects=0):
         if url in self.perm_redirects:
             url = self.perm_redirects[url]
         method = method.upper()
@@ -251,9 +974,15 @@ class Session(object):
             headers = {}
         headers.setdefault('Accept', 'application/json')
         headers['User-Agent'] = self.user_agent
+        if self.accept_gzip:
+            headers.setdefault('Accept-Encoding', 'gzip')
 
+        # The cache is keyed by URL only, so partial responses and responses
+        # in other formats than the default are neither used nor stored
+        cacheable = method in ('GET', 'HEAD') and 'Range' not in headers and \
+            headers['Accept'] == 'application/json'
         cached_resp = None
-        if method in ('GET', 'HEAD'):
+        if cacheable:
             cached_resp = self.cache.get(url)
             if cached_resp is not None:
                 etag = cached_resp[1].get('etag')
@@ -265,55 +994,129 @@ class Session(object):
             body = json.encode(body).encode('utf-8')
             headers.setdefault('Content-Type', 'application/json')
 
+        if self.gzip_threshold is not None and isinstance(body, str) and \
+                len(body) >= self.gzip_threshold and \
+                'Content-Encoding' not in headers and \
+                'application/json' in headers.get('Content-Type', ''):
+            body = gzip_compress(body)
+            headers['Content-Encoding'] = 'gzip'
+
         if body is None:
             headers.setdefault('Content-Length', '0')
         elif isinstance(body, basestring):
             headers.setdefault('Content-Length', str(len(body)))
-        else:
+        elif 'Content-Length' not in headers:
+            # Send file-like bodies of unknown length in chunks
             headers['Transfer-Encoding'] = 'chunked'
+        chunked = headers.get('Transfer-Encoding') == 'chunked'
 
         authorization = basic_auth(credentials)
         if authorization:
             headers['Authorization'] = authorization
 
+        stats = RequestStats(method, url)
+        stats.cache_hit = cached_resp is not None
         path_query = urlunsplit(('', '') + urlsplit(url)[2:4] + ('',))
-        conn = self.connection_pool.get(url)
-
-        def _try_request_with_retries(retries):
+        # Size of the request line and headers, not counting those added by
+        # httplib itself, which converts header values with str()
+        head_size = len(method) + len(path_query) + 13 + \
+            sum([len(k) + len(str(v)) + 4 for k, v in headers.items()])
+        breaker = self.circuit_breaker
+        if breaker is not None:
+            # Fail fast, without waiting for a pooled connection
+            try:
+                breaker.before(url)
+            except CircuitOpen, e:
+                stats.error = e
+                self._report(stats)
+                raise
+
+        def _try_request_with_retries():
+            attempt = 0
             while True:
+                if breaker is not None and attempt:
+                    breaker.before(url)
                 try:
-                    return _try_request()
+                    resp = _try_request()
                 except socket.error, e:
-                    ecode = e.args[0]
-                    if ecode not in self.retryable_errors:
+                    if breaker is not None:
+                        breaker.failure(url)
+                    delay = self.retry_policy.delay(method, attempt, error=e)
+                    if delay is None or not _rewind():
                         raise
-                    try:
-                        delay = retries.next()
-                    except StopIteration:
-                        # No more retries, raise last socket error.
-                        raise e
-                    time.sleep(delay)
                     conn.close()
+                else:
+                    if breaker is not None:
+                        if resp.status >= 500:
+                            breaker.failure(url)
+                        else:
+                            breaker.success(url)
+                    if resp.status < 400:
+                        return resp
+                    delay = self.retry_policy.delay(method, attempt,
+                                                    status=resp.status)
+                    if delay is None or not _rewind():
+                        return resp
+                    resp.read()
+                attempt += 1
+                stats.retries = attempt
+                time.sleep(delay)
+
+        body_pos = None
+        if hasattr(body, 'read') and hasattr(body, 'tell'):
+            try:
+                body_pos = body.tell()
+            except (IOError, OSError):
+                pass
+
+        def _rewind():
+            # Check whether the body can be sent again, and rewind file-like
+            # bodies to where they started.
+            if body is None or isinstance(body, basestring):
+                return True
+            if body_pos is None:
+                return False
+            body.seek(body_pos)
+            return True
 
         def _try_request():
             try:
+                if conn.sock is None:
+                    connect_started = time.time()
+                    conn.connect()
+                    stats.connect += time.time() - connect_started
+                sent = time.time()
                 conn.putrequest(method, path_query, skip_accept_encoding=True)
                 for header in headers:
                     conn.putheader(header, headers[header])
+                stats.bytes_sent += head_size
                 if body is None:
                     conn.endheaders()
                 else:
                     if isinstance(body, str):
                         conn.endheaders(body)
-                    else: # assume a file-like object and send in chunks
+                        stats.bytes_sent += len(body)
+                    elif chunked: # assume a file-like object
                         conn.endheaders()
                         while 1:
                             chunk = body.read(CHUNK_SIZE)
                             if not chunk:
                                 break
                             conn.send(('%x\r\n' % len(chunk)) + chunk + '\r\n')
+                            stats.bytes_sent += len(chunk)
                         conn.send('0\r\n\r\n')
-                return conn.getresponse()
+                    else: # a file-like object with the given Content-Length
+                        conn.endheaders()
+                        while 1:
+                            block = body.read(SEND_BLOCK_SIZE)
+                            if not block:
+                                break
+                            conn.send(block)
+                            stats.bytes_sent += len(block)
+                self._await_response(conn)
+                resp = conn.getresponse()
+                stats.ttfb = time.time() - sent
+                return resp
             except BadStatusLine, e:
                 # httplib raises a BadStatusLine when it cannot read the status
                 # line saying, "Presumably, the server closed the connection
@@ -324,13 +1127,60 @@ class Session(object):
                 else:
                     raise
 
-        resp = _try_request_with_retries(iter(self.retry_delays))
-        status = resp.status
+        # Take a connection only once everything else is prepared, so that
+        # nothing can fail before the block that returns it to the pool
+        started = time.time()
+        conn = self.connection_pool.get(url)
+        stats.pool_wait = time.time() - started
+        try:
+            self.retry_policy.started(method)
+            resp = _try_request_with_retries()
+        except CircuitOpen, e:
+            # Raised before a retry. The connection is still usable unless it
+            # was closed after a socket error.
+            if conn.sock is None:
+                self.connection_pool.discard(url, conn)
+            else:
+                self.connection_pool.release(url, conn)
+            stats.error = e
+            self._report(stats)
+            raise
+        except Exception, e:
+            self.connection_pool.discard(url, conn)
+            stats.error = e
+            self._report(stats)
+            raise
+        received = time.time()
+        status = stats.status = resp.status
+
+        def _read_all():
+            # Read the remaining body and return the connection to the pool
+            try:
+                bytes = resp.read()
+            except Exception, e:
+                # The connection is in an undefined state
+                self.connection_pool.discard(url, conn)
+                stats.error = e
+                self._report(stats)
+                raise
+            self.connection_pool.release(url, conn)
+            stats.bytes_received += len(bytes)
+            stats.body_read = time.time() - received
+            return bytes
 
         # Handle conditional response
         if status == 304 and method in ('GET', 'HEAD'):
-            resp.read()
-            self.connection_pool.release(url, conn)
+            _read_all()
+            if cached_resp is None:
+                # Not the answer to an If-None-Match sent from the cache
+                error = ServerError((status, 'no cached response for %s'
+                                             % url))
+                stats.error = error
+                self._report(stats)
+                raise error
+            self.cache.revalidated(url)
+            stats.not_modified = True
+            self._report(stats)
             status, msg, data = cached_resp
             if data is not None:
                 data = StringIO(data)
@@ -341,8 +1191,8 @@ class Session(object):
         # Handle redirects
         if status == 303 or \
                 method in ('GET', 'HEAD') and status in (301, 302, 307):
-            resp.read()
-            self.connection_pool.release(url, conn)
+            _read_all()
+            self._report(stats)
             if num_redirects > self.max_redirects:
                 raise RedirectLimit('Redirection limit exceeded')
             location = resp.getheader('location')
@@ -355,37 +1205,52 @@ class Session(object):
 
         data = None
         streamed = False
+        decoder = None
+        if resp.getheader('content-encoding') in ('gzip', 'deflate'):
+            # Accept both gzip and zlib framing
+            decoder = zlib.decompressobj(32 + zlib.MAX_WBITS)
 
         # Read the full response for empty responses so that the connection is
         # in good state for the next request
         if method == 'HEAD' or resp.getheader('content-length') == '0' or \
                 status < 200 or status in (204, 304):
-            resp.read()
-            self.connection_pool.release(url, conn)
+            _read_all()
 
         # Buffer small non-JSON response bodies
         elif int(resp.getheader('content-length', sys.maxint)) < CHUNK_SIZE:
-            data = resp.read()
-            self.connection_pool.release(url, conn)
+            data = _read_all()
+            if decoder is not None:
+                data = decoder.decompress(data) + decoder.flush()
 
         # For large or chunked response bodies, do not buffer the full body,
         # and instead return a minimal file-like object
         else:
-            data = ResponseBody(resp,
-                                lambda: self.connection_pool.release(url, conn))
+            def _done(discard=False):
+                if discard:
+                    self.connection_pool.discard(url, conn)
+                else:
+                    self.connection_pool.release(url, conn)
+                stats.bytes_received = data.bytes_read
+                stats.body_read = time.time() - received
+                self._report(stats)
+            data = ResponseBody(resp, _done, lambda: _done(discard=True),
+                                decoder)
             streamed = True
 
         # Handle errors
         if status >= 400:
-            ctype = resp.getheader('content-type')
+            if streamed:
+                data = data.read()
+            ctype = resp.getheader('content-type') or ''
             if data is not None and 'application/json' in ctype:
                 data = json.decode(data)
                 error = data.get('error'), data.get('reason')
             elif method != 'HEAD':
-                error = resp.read()
-                self.connection_pool.release(url, conn)
+                error = data
             else:
                 error = ''
+            if not streamed:
+                self._report(stats)
             if status == 401:
                 raise Unauthorized(error)
             elif status == 404:
@@ -397,94 +1262,812 @@ class Session(object):
             else:
                 raise ServerError((status, error))
 
-        # Store cachable responses
-        if not streamed and method == 'GET' and 'etag' in resp.msg:
-            self.cache.put(url, (status, resp.msg, data))
-
-        if not streamed and data is not None:
-            data = StringIO(data)
+        # Store cachable responses (but not partial content)
+        if cacheable and method == 'GET' and status == 200 and \
+                'etag' in resp.msg:
+            if not streamed:
+                self.cache.put(url, (status, resp.msg, data))
+            elif self.cache_streamed is not None:
+                data.tee(self.cache_streamed, lambda body:
+                         self.cache.put(url, (status, resp.msg, body)))
+
+        if not streamed:
+            self._report(stats)
+            if data is not None:
+                data = StringIO(data)
 
         return status, resp.msg, data
 
+    def _report(self, stats):
+        for hook in self.hooks:
+            hook(stats)
+
+    def _await_response(self, conn):
+        # Called after a request has been sent on the given connection, before
+        # its response is read
+        pass
+
+
+def url_template(url):
+    """Return the path of the given URL with the names of databases,
+    documents, design documents, views and attachments replaced by
+    placeholders.
+
+    >>> url_template('http://localhost:5984/mydb/mydoc?rev=1-abc')
+    '/{db}/{docid}'
+    >>> url_template('http://localhost:5984/mydb/_design/app/_view/by_date')
+    '/{db}/_design/{ddoc}/_view/{view}'
+    >>> url_template('http://localhost:5984/mydb/mydoc/photo.jpg')
+    '/{db}/{docid}/{attachment}'
+    >>> url_template('http://localhost:5984/mydb/_bulk_docs')
+    '/{db}/_bulk_docs'
+    >>> url_template('http://localhost:5984/_all_dbs')
+    '/_all_dbs'
+    """
+    segments = [s for s in urlsplit(url)[2].split('/') if s]
+    if not segments:
+        return '/'
+    if segments[0].startswith('_'):
+        # Server-level resources, such as _all_dbs or _stats/couchdb/...
+        return '/' + segments[0]
+    retval = ['{db}']
+    rest = segments[1:]
+    if not rest:
+        pass
+    elif rest[0] == '_design':
+        retval.append('_design')
+        names = ['{ddoc}']
+        if len(rest) > 2 and rest[2].startswith('_'):
+            # _view, _show, _list, _update, _info, ...
+            names.extend([rest[2], '{%s}' % rest[2][1:]])
+            if rest[2] == '_list' and len(rest) > 4:
+                names.append('{view}')
+        elif len(rest) > 2:
+            names.append('{attachment}')
+        retval.extend(names[:len(rest) - 1])
+    elif rest[0] == '_local':
+        retval.extend(['_local', '{docid}'][:len(rest)])
+    elif rest[0].startswith('_'):
+        # _all_docs, _changes, _bulk_docs, _compact/ddoc, ...
+        retval.append(rest[0])
+        if len(rest) > 1:
+            retval.append('{ddoc}')
+    else:
+        retval.append('{docid}')
+        if len(rest) > 1:
+            retval.append('{attachment}')
+    return '/' + '/'.join(retval)
+
+
+class ClusterSession(Session):
+    """A session that spreads requests across the nodes of a cluster.
+
+    Requests for URLs below one of the node URLs are sent to the node that
+    currently has the fewest outstanding requests (``least_outstanding``), or
+    the lowest moving average of GET response times (``ewma``). For example:
+
+    >>> session = ClusterSession(['http://node1:5984/', 'http://node2:5984/'])
+    >>> server = Server('http://node1:5984/', session=session) #doctest: +SKIP
+
+    Nodes that fail `max_failures` times in a row (connection errors or 5xx
+    responses) are ejected for `eject_timeout` seconds. Idempotent requests
+    that fail this way are retried on another node, after the session's
+    retry policy has given up on the first one.
+
+    If `hedge_percentile` is set, GET requests are hedged: when a node has
+    not responded within that percentile of the recent GET response times,
+    the request is also sent to a second node from another thread, and
+    whichever response arrives first is used. Until enough response times
+    have been collected, `hedge_delay` seconds are used instead. Feeds,
+    ranged requests and requests for other formats than JSON are neither
+    hedged nor counted in the response times.
+
+    Other keyword arguments are passed on to `Session`.
+
+    :since: 0.10
+    """
+
+    def __init__(self, nodes, strategy='least_outstanding', max_failures=3,
+                 eject_timeout=30, decay=0.3, hedge_percentile=None,
+                 hedge_delay=0.1, hedge_window=200, **kwargs):
+        """Initialize the cluster session.
+
+        :param nodes: the base URLs of the cluster nodes
+        :param strategy: ``least_outstanding`` or ``ewma``
+        :param max_failures: the number of consecutive failures after which a
+                             node is ejected
+        :param eject_timeout: the number of seconds an ejected node receives
+                              no requests
+        :param decay: the weight of the latest response time in the moving
+                      average
+        :param hedge_percentile: the percentile of recent GET response times
+                                 after which a hedged request is sent, or
+                                 `None` to disable hedging
+        :param hedge_delay: the delay before sending a hedged request while
+                            fewer than 20 response times are known
+        :param hedge_window: the number of recent response times to keep
+        """
+        Session.__init__(self, **kwargs)
+        if strategy not in ('least_outstanding', 'ewma'):
+            raise ValueError('unknown routing strategy %r' % strategy)
+        if not nodes:
+            raise ValueError('at least one node URL is required')
+        self.nodes = [_Node(url) for url in nodes]
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.eject_timeout = eject_timeout
+        self.decay = decay
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = hedge_delay
+        self.hedge_min_samples = 20
+        self.latencies = deque(maxlen=hedge_window)
+        self.node_lock = Lock()
+        self.local = local()
+
+    def _request(self, method, url, body=None, headers=None, credentials=None,
+                 num_redirects=0):
+        node = self._match(url)
+        if node is None:
+            return Session._request(self, method, url, body, headers,
+                                    credentials, num_redirects)
+        path = url[len(node.url):]
+        args = (headers, credentials, num_redirects)
+        sample = _is_plain_get(method, path, body, headers)
+        if sample and self.hedge_percentile is not None and \
+                len(self.nodes) > 1:
+            return self._hedge(path, args)
+
+        failover = method in IDEMPOTENT_METHODS and not hasattr(body, 'read')
+        tried = []
+        while True:
+            node = self._choose(tried)
+            tried.append(node)
+            try:
+                return self._send(node, method, path, body, args, sample)
+            except:
+                if failover and len(tried) < len(self.nodes) and \
+                        _is_node_failure(sys.exc_info()[1]):
+                    continue
+                raise
+
+    def hedge_delay(self):
+        """Return the time to wait for a response before a GET request is sent
+        to a second node.
+        """
+        self.node_lock.acquire()
+        try:
+            samples = sorted(self.latencies)
+        finally:
+            self.node_lock.release()
+        if len(samples) < self.hedge_min_samples:
+            return self.initial_hedge_delay
+        idx = int(len(samples) * self.hedge_percentile / 100.0)
+        return samples[min(idx, len(samples) - 1)]
+
+    def _send(self, node, method, path, body, args, sample=False):
+        # Send a request to the given node, which must have been returned by
+        # _choose(), and keep track of the node's health. The response time
+        # is only recorded if `sample` is true. Session._request() adds
+        # headers such as If-None-Match for the node at hand, so every attempt
+        # gets its own copy of the headers.
+        headers, credentials, num_redirects = args
+        headers = dict(headers or {})
+        started = time.time()
+        try:
+            status, msg, data = Session._request(self, method,
+                                                 node.url + path, body,
+                                                 headers, credentials,
+                                                 num_redirects)
+        except:
+            self._done(node, time.time() - started,
+                       failed=_is_node_failure(sys.exc_info()[1]),
+                       sample=sample)
+            raise
+
+        elapsed = time.time() - started
+        if isinstance(data, ResponseBody):
+            # The node is busy until the body has been read
+            self._done(node, elapsed, finished=False, sample=sample)
+            callback, discard = data.callback, data.discard
+            def _callback():
+                callback()
+                self._finish(node)
+            def _discard():
+                if discard is not None:
+                    discard()
+                self._finish(node)
+            data.callback, data.discard = _callback, _discard
+        else:
+            self._done(node, elapsed, sample=sample)
+        if sample:
+            self.node_lock.acquire()
+            try:
+                self.latencies.append(elapsed)
+            finally:
+                self.node_lock.release()
+        return status, msg, data
+
+    def _hedge(self, path, args):
+        hedge = _Hedge(self, path, args)
+        outer = getattr(self.local, 'hedge', None)
+        self.local.hedge = hedge
+        try:
+            return hedge.run()
+        finally:
+            self.local.hedge = outer
+
+    def _await_response(self, conn):
+        hedge = getattr(self.local, 'hedge', None)
+        if hedge is not None:
+            hedge.wait(conn)
+
+    def _match(self, url):
+        for node in self.nodes:
+            if url.startswith(node.url) or url == node.url[:-1]:
+                return node
+
+    def _choose(self, exclude):
+        now = time.time()
+        self.node_lock.acquire()
+        try:
+            candidates = [node for node in self.nodes if node not in exclude]
+            healthy = [node for node in candidates if node.ejected <= now]
+            if not healthy:
+                # Give the node that was ejected first another chance
+                healthy = [min(candidates, key=lambda node: node.ejected)]
+            if self.strategy == 'ewma':
+                key = lambda node: (node.latency, node.outstanding,
+                                    random.random())
+            else:
+                key = lambda node: (node.outstanding, node.latency,
+                                    random.random())
+            node = min(healthy, key=key)
+            node.outstanding += 1
+            return node
+        finally:
+            self.node_lock.release()
+
+    def _done(self, node, elapsed, failed=False, finished=True, sample=True):
+        self.node_lock.acquire()
+        try:
+            if finished:
+                node.outstanding -= 1
+            if sample and node.latency:
+                node.latency += self.decay * (elapsed - node.latency)
+            elif sample:
+                node.latency = elapsed
+            if not failed:
+                node.failures = 0
+                return
+            node.failures += 1
+            if node.failures >= self.max_failures:
+                node.ejected = time.time() + self.eject_timeout
+        finally:
+            self.node_lock.release()
+
+    def _finish(self, node):
+        self.node_lock.acquire()
+        try:
+            node.outstanding -= 1
+        finally:
+            self.node_lock.release()
+
+
+def _is_plain_get(method, url, body, headers):
+    # Whether a request is a GET with a response that is complete as soon as
+    # it has arrived, so that it can be shared by coalesced requests, hedged,
+    # and used as a sample of response times. Feeds stay open until something
+    # changes, and ranged or non-JSON downloads are meant to be streamed.
+    if method != 'GET' or body is not None:
+        return False
+    headers = headers or {}
+    return '/_changes' not in '/' + url and 'feed=' not in url and \
+        'Range' not in headers and \
+        headers.get('Accept', 'application/json') == 'application/json'
+
+
+def _is_node_failure(error):
+    # Whether an error indicates that a node is unavailable, as opposed to a
+    # definitive response such as a 404
+    if isinstance(error, ServerError):
+        return error.args[0][0] >= 500
+    return isinstance(error, (socket.error, CircuitOpen, Timeout))
+
+
+class _Node(object):
+
+    def __init__(self, url):
+        if not url.endswith('/'):
+            url += '/'
+        self.url = url
+        self.outstanding = 0 # requests sent and not yet completely read
+        self.latency = 0.0 # moving average of response times
+        self.failures = 0 # consecutive failures
+        self.ejected = 0 # time until which no requests are sent
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.url)
+
+
+class _Hedged(Exception):
+    # Raised in the calling thread of a hedged request once the request sent
+    # to another node has won
+    pass
+
+
+class _Hedge(object):
+    # A hedged GET request. The calling thread sends the request to one node
+    # and waits for the response to arrive; only if that takes too long, the
+    # request is also sent to another node from a new thread. The first final
+    # outcome wins, and the other response is discarded.
+
+    poll_interval = 0.01
+
+    def __init__(self, session, path, args):
+        self.session = session
+        self.path = path
+        # Threads copy the headers for their attempt from a private snapshot,
+        # as the caller may reuse its dict once the request has returned
+        headers, credentials, num_redirects = args
+        self.args = (dict(headers or {}), credentials, num_redirects)
+        self.lock = Lock()
+        self.tried = [] # nodes the request has been sent to
+        self.pending = 0 # outcomes of other threads not yet looked at
+        self.winner = None # the node whose outcome is used
+        self.results = Queue() # (node, result, exc_info) from other threads
+        self.deadline = None # when to send the request to another node
+
+    def run(self):
+        delay = self.session.hedge_delay()
+        exc_info = None
+        while True:
+            node = self._choose()
+            if node is None:
+                return self._wait(exc_info)
+            self.deadline = time.time() + delay
+            try:
+                result = self.session._send(node, 'GET', self.path, None,
+                                            self.args, True)
+            except _Hedged:
+                return self._wait(None)
+            except:
+                exc_info = sys.exc_info()
+                if _is_node_failure(exc_info[1]):
+                    if self.winner is None:
+                        continue
+                    return self._wait(exc_info)
+                if self._claim(node):
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                return self._wait(None)
+            if self._claim(node):
+                return result
+            self._discard(result)
+            return self._wait(None)
+
+    def wait(self, conn):
+        # Called in the calling thread once the request has been sent. Waits
+        # for the response to start arriving, sending the request to another
+        # node when the deadline passes, and gives up on the connection if
+        # another node wins in the meantime.
+        while True:
+            if self.winner is not None:
+                raise _Hedged()
+            if self.deadline is not None:
+                timeout = max(0, self.deadline - time.time())
+            elif self.pending:
+                timeout = self.poll_interval
+            else:
+                return
+            try:
+                if select([conn.sock], [], [], timeout)[0]:
+                    return
+            except (select_error, socket.error, TypeError, ValueError):
+                # Leave it to httplib to report the problem
+                return
+            if self.deadline is not None:
+                self.deadline = None
+                self._start()
+
+    def _run(self, node):
+        try:
+            result = self.session._send(node, 'GET', self.path, None,
+                                        self.args, True)
+            exc_info = None
+        except:
+            result, exc_info = None, sys.exc_info()
+        if exc_info is not None and _is_node_failure(exc_info[1]):
+            if self.winner is None:
+                self._start()
+        elif not self._claim(node):
+            self._discard(result)
+        self.results.put((node, result, exc_info))
+
+    def _start(self):
+        # Send the request to another node from a new thread
+        node = self._choose(thread=True)
+        if node is not None:
+            thread = Thread(target=self._run, args=(node,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def _wait(self, exc_info):
+        # Return the outcome of the winning request in another thread. If
+        # there is none, all nodes failed, and the last failure is raised.
+        while True:
+            self.lock.acquire()
+            try:
+                if not self.pending:
+                    break
+                self.pending -= 1
+            finally:
+                self.lock.release()
+            node, result, thread_exc_info = self.results.get()
+            if node is self.winner:
+                if thread_exc_info is not None:
+                    exc_info = thread_exc_info
+                    break
+                return result
+            if thread_exc_info is not None:
+                exc_info = thread_exc_info
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _choose(self, thread=False):
+        self.lock.acquire()
+        try:
+            if len(self.tried) == len(self.session.nodes):
+                return None
+            node = self.session._choose(self.tried)
+            self.tried.append(node)
+            if thread:
+                self.pending += 1
+            return node
+        finally:
+            self.lock.release()
+
+    def _claim(self, node):
+        self.lock.acquire()
+        try:
+            if self.winner is None:
+                self.winner = node
+            return self.winner is node
+        finally:
+            self.lock.release()
+
+    def _discard(self, result):
+        if result is not None and isinstance(result[2], ResponseBody):
+            result[2]._abort()
 
-def cache_sort(i):
-    return datetime.fromtimestamp(time.mktime(parsedate(i[1][1]['Date'])))
 
 class Cache(object):
-    """Content cache."""
+    """Content cache.
 
-    # Some random values to limit memory use
-    keep_size, max_size = 10, 75
+    Responses are kept in least-recently-used order. The least recently used
+    responses are evicted as soon as the cache holds more than `max_size`
+    entries, or the cached bodies take up more than `max_bytes` bytes in total.
 
-    def __init__(self):
-        self.by_url = {}
+    The cache keeps count of lookups that found an entry (`hits`) or didn't
+    (`misses`), of cached responses that the server confirmed to be unchanged
+    (`revalidations`) and of entries dropped to make room (`evictions`).
+    """
+
+    def __init__(self, max_size=75, max_bytes=1024 * 1024, by_url=None):
+        """Initialize the cache.
+
+        :param max_size: maximum number of cached responses
+        :param max_bytes: maximum total size of the cached response bodies;
+                          larger bodies are never cached
+        :param by_url: a dict-like object to store the responses in
+        """
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        if by_url is None:
+            by_url = {}
+        self.by_url = by_url
+        self.size = 0 # total size of the cached bodies in bytes
+        self.hits = self.misses = self.revalidations = self.evictions = 0
+        self.lock = Lock()
+        # Doubly linked list of [prev, next, url, size] entries in order of
+        # use, with the least recently used entry right after the root.
+        self._root = root = []
+        root[:] = [root, root, None, 0]
+        self._links = {}
+        for url in list(self.by_url):
+            self._link(url, _body_size(self.by_url[url]))
+
+    def __len__(self):
+        return len(self._links)
 
     def get(self, url):
-        return self.by_url.get(url)
+        self.lock.acquire()
+        try:
+            response = self.by_url.get(url)
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            link = self._links.get(url)
+            if link is None:
+                self._link(url, _body_size(response))
+            else:
+                self._unlink(link)
+                self._append(link)
+            return response
+        finally:
+            self.lock.release()
 
     def put(self, url, response):
-        self.by_url[url] = response
-        if len(self.by_url) > self.max_size:
-            self._clean()
+        size = _body_size(response)
+        self.lock.acquire()
+        try:
+            self._remove(url)
+            if size > self.max_bytes:
+                return
+            self.by_url[url] = response
+            self._link(url, size)
+            while len(self._links) > self.max_size or \
+                    self.size > self.max_bytes:
+                self._remove(self._root[1][2])
+                self.evictions += 1
+        finally:
+            self.lock.release()
 
     def remove(self, url):
+        self.lock.acquire()
+        try:
+            self._remove(url)
+        finally:
+            self.lock.release()
+
+    def revalidated(self, url):
+        """Record that the server confirmed the cached response for `url` to
+        still be current.
+        """
+        self.lock.acquire()
+        try:
+            self.revalidations += 1
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """Return the cache counters and current size as a dictionary."""
+        return {'entries': len(self._links), 'bytes': self.size,
+                'hits': self.hits, 'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions}
+
+    def _remove(self, url):
         self.by_url.pop(url, None)
+        link = self._links.pop(url, None)
+        if link is not None:
+            self._unlink(link)
+            self.size -= link[3]
+
+    def _link(self, url, size):
+        link = [None, None, url, size]
+        self._links[url] = link
+        self._append(link)
+        self.size += size
 
-    def _clean(self):
-        ls = sorted(self.by_url.iteritems(), key=cache_sort)
-        self.by_url = dict(ls[-self.keep_size:])
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        link[0], link[1] = last, root
+        last[1] = root[0] = link
+
+    def _unlink(self, link):
+        prev_link, next_link = link[0], link[1]
+        prev_link[1], next_link[0] = next_link, prev_link
+
+
+def _body_size(response):
+    data = response[2]
+    if data is None:
+        return 0
+    return len(data)
 
 
 class ConnectionPool(object):
-    """HTTP connection pool."""
+    """HTTP connection pool.
+
+    Idle connections are kept per ``(scheme, host)`` and reused in LIFO order.
+    Before a connection is handed out again it is checked for liveness, and
+    connections that have been idle for longer than `idle_timeout` seconds are
+    closed instead of being reused.
+
+    If `max_size` is set, no more than that many connections (idle or in use)
+    are opened to a single host; `get()` then blocks until a connection is
+    released, or raises `Timeout` once `wait_timeout` seconds have passed.
+    """
 
-    def __init__(self, timeout):
+    def __init__(self, timeout, max_size=None, wait_timeout=None,
+                 idle_timeout=None):
         self.timeout = timeout
-        self.conns = {} # HTTP connections keyed by (scheme, host)
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.idle_timeout = idle_timeout
+        self.conns = {} # idle (connection, release time) keyed by (scheme, host)
+        self.counts = {} # number of idle and busy connections per key
+        self.created = 0 # connections created over the pool's lifetime
+        self.discarded = 0 # connections closed instead of being reused
         self.lock = Lock()
+        self.available = Condition(self.lock)
 
     def get(self, url):
 
-        scheme, host = urlsplit(url, 'http', False)[:2]
+        key = _pool_key(url)
+        discarded = []
 
-        # Try to reuse an existing connection.
         self.lock.acquire()
         try:
-            conns = self.conns.setdefault((scheme, host), [])
-            if conns:
-                conn = conns.pop(-1)
-            else:
-                conn = None
+            deadline = None
+            while True:
+                # Try to reuse an existing connection.
+                conn = self._pop_idle(key, discarded)
+                if conn is not None:
+                    break
+                # Make room for a new connection if the limit allows.
+                count = self.counts.get(key, 0)
+                if self.max_size is None or count < self.max_size:
+                    self.counts[key] = count + 1
+                    break
+                # Wait for another thread to release a connection.
+                if self.wait_timeout is None:
+                    self.available.wait()
+                    continue
+                if deadline is None:
+                    deadline = time.time() + self.wait_timeout
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Timeout('no connection to %s://%s available within '
+                                  '%s seconds' % (key + (self.wait_timeout,)))
+                self.available.wait(remaining)
         finally:
             self.lock.release()
 
-        # Create a new connection if nothing was available.
+        for idle in discarded:
+            idle.close()
+
+        # Create a new connection if nothing was available. It connects
+        # when the first request is sent, so that connection errors are
+        # subject to the session's retry policy.
         if conn is None:
-            if scheme == 'http':
-                cls = HTTPConnection
-            elif scheme == 'https':
-                cls = HTTPSConnection
-            else:
-                raise ValueError('%s is not a supported scheme' % scheme)
-            conn = cls(host, timeout=self.timeout)
-            conn.connect()
+            try:
+                conn = self._create(key)
+            except:
+                self._forget(key)
+                raise
 
         return conn
 
     def release(self, url, conn):
-        scheme, host = urlsplit(url, 'http', False)[:2]
+        key = _pool_key(url)
+        self.lock.acquire()
+        try:
+            self.conns.setdefault(key, []).append((conn, time.time()))
+            self.available.notify()
+        finally:
+            self.lock.release()
+
+    def discard(self, url, conn):
+        """Close a connection that was obtained from `get()` but cannot be
+        reused, for example because a request on it failed half-way.
+        """
+        conn.close()
+        self._forget(_pool_key(url), discarded=True)
+
+    def prewarm(self, url, count):
+        """Open up to `count` idle connections to the host of the given URL
+        ahead of time, within the limits of `max_size`.
+        """
+        key = _pool_key(url)
+        conns = []
+        try:
+            for idx in range(count):
+                self.lock.acquire()
+                try:
+                    num = self.counts.get(key, 0)
+                    if self.max_size is not None and num >= self.max_size:
+                        break
+                    self.counts[key] = num + 1
+                finally:
+                    self.lock.release()
+                try:
+                    conn = self._create(key)
+                    conn.connect()
+                    conns.append(conn)
+                except:
+                    self._forget(key)
+                    raise
+        finally:
+            for conn in conns:
+                self.release(url, conn)
+
+    def stats(self):
+        """Return the number of idle and in-use connections, and the numbers
+        of connections created and discarded so far, as a dictionary.
+        """
+        self.lock.acquire()
+        try:
+            idle = sum([len(conns) for conns in self.conns.values()])
+            return {'idle': idle, 'in_use': sum(self.counts.values()) - idle,
+                    'created': self.created, 'discarded': self.discarded}
+        finally:
+            self.lock.release()
+
+    def _create(self, key):
+        scheme, host = key
+        if scheme == 'http':
+            cls = HTTPConnection
+        elif scheme == 'https':
+            cls = HTTPSConnection
+        else:
+            raise ValueError('%s is not a supported scheme' % scheme)
+        conn = cls(host, timeout=self.timeout)
         self.lock.acquire()
         try:
-            self.conns.setdefault((scheme, host), []).append(conn)
+            self.created += 1
         finally:
             self.lock.release()
+        return conn
+
+    def _forget(self, key, discarded=False):
+        self.lock.acquire()
+        try:
+            self.counts[key] -= 1
+            if discarded:
+                self.discarded += 1
+            self.available.notify()
+        finally:
+            self.lock.release()
+
+    def _pop_idle(self, key, discarded):
+        # Must be called with the lock held. Stale connections are removed
+        # from the pool and added to `discarded` for the caller to close.
+        conns = self.conns.get(key)
+        if not conns:
+            return None
+        if self.idle_timeout is not None:
+            # The oldest connections are at the front of the list.
+            horizon = time.time() - self.idle_timeout
+            while conns and conns[0][1] < horizon:
+                discarded.append(conns.pop(0)[0])
+                self.counts[key] -= 1
+                self.discarded += 1
+        while conns:
+            conn = conns.pop(-1)[0]
+            if _is_alive(conn):
+                return conn
+            discarded.append(conn)
+            self.counts[key] -= 1
+            self.discarded += 1
+        return None
 
     def __del__(self):
         for key, conns in list(self.conns.items()):
-            for conn in conns:
+            for conn, released in conns:
                 conn.close()
 
 
+def _pool_key(url):
+    return tuple(urlsplit(url, 'http', False)[:2])
+
+
+def _is_alive(conn):
+    """Check whether an idle connection can be reused.
+
+    A connection that has been closed by the client will transparently
+    reconnect. An idle socket should never be readable though: if it is, the
+    server has either closed its end or sent unexpected data.
+    """
+    if conn.sock is None:
+        return True
+    try:
+        readable = select([conn.sock], [], [], 0)[0]
+    except (select_error, socket.error, ValueError):
+        return False
+    return not readable
+
+
 class Resource(object):
 
     def __init__(self, url, session, headers=None):
@@ -573,6 +2156,17 @@ def extract_credentials(url):
     return urlunsplit(parts), credentials
 
 
+def gzip_compress(data, level=6):
+    """Compress a string into the gzip format.
+
+    >>> import zlib
+    >>> zlib.decompress(gzip_compress('foo' * 10), 16 + zlib.MAX_WBITS)
+    'foofoofoofoofoofoofoofoofoofoo'
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
 def basic_auth(credentials):
     if credentials:
         return 'Basic %s' % b64encode('%s:%s' % credentials)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 couchdb-python contributors
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+"""Aggregation of request metrics for `couchdb.http.Session` objects.
+
+A `Registry` is installed as a hook on a session, and collects request
+counters and latency histograms per endpoint class. Together with gauges for
+the connection pool and statistics of the response cache, it can render the
+collected metrics in the Prometheus text exposition format:
+
+>>> from couchdb.http import Session
+>>> session = Session()
+>>> registry = Registry(session)
+>>> print registry.render() #doctest: +ELLIPSIS
+# HELP couchdb_client_requests_total Number of completed requests.
+# TYPE couchdb_client_requests_total counter
+...
+couchdb_client_pool_connections{state="idle"} 0
+...
+
+:since: 0.10
+"""
+
+from threading import Lock
+
+from couchdb.http import url_template
+
+__all__ = ['Registry', 'endpoint', 'DEFAULT_BUCKETS']
+__docformat__ = 'restructuredtext en'
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+def endpoint(path):
+    """Return the endpoint class of a URL path as returned by
+    `couchdb.http.url_template()`.
+
+    >>> endpoint('/{db}/{docid}')
+    'doc'
+    >>> endpoint('/{db}/_design/{ddoc}/_view/{view}')
+    'view'
+    >>> endpoint('/{db}/_all_docs')
+    'view'
+    >>> endpoint('/{db}/_bulk_docs')
+    'bulk_docs'
+    >>> endpoint('/{db}/_changes')
+    'changes'
+    >>> endpoint('/{db}/{docid}/{attachment}')
+    'attachment'
+    >>> endpoint('/_all_dbs')
+    'other'
+    """
+    segments = path.split('/')[2:]
+    if not segments:
+        return 'other'
+    if '{attachment}' in segments:
+        return 'attachment'
+    if segments[0] in ('_bulk_docs', '_changes'):
+        return segments[0][1:]
+    if segments[0] in ('_all_docs', '_temp_view') or '_view' in segments:
+        return 'view'
+    if segments[0] == '{docid}' or segments[0] in ('_local', '_design') and \
+            len(segments) == 2:
+        return 'doc'
+    return 'other'
+
+
+class Registry(object):
+    """Collects metrics of the requests made through one or more sessions.
+
+    A registry is a callable suitable as a hook of `couchdb.http.Session`.
+    If a session is passed to the constructor, the registry adds itself to
+    the hooks of that session, and includes the gauges of the session's
+    connection pool and cache when rendering.
+
+    Requests are counted per endpoint class (see `endpoint()`), method and
+    status code, where failed requests that did not receive a response are
+    counted with the status ``error``.
+
+    :param session: the `Session` to instrument, or `None`
+    :param buckets: the upper bounds of the latency histogram buckets, in
+                    seconds
+    """
+
+    def __init__(self, session=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.sessions = []
+        self.lock = Lock()
+        self._requests = {} # (endpoint, method, status) -> count
+        self._counters = {} # (name, endpoint, method) -> value
+        self._histograms = {} # (name, endpoint, method) -> [counts, sum]
+        if session is not None:
+            self.attach(session)
+
+    def __call__(self, stats):
+        self.observe(stats)
+
+    def attach(self, session):
+        """Install the registry as a hook on the given session."""
+        session.hooks.append(self)
+        self.sessions.append(session)
+
+    def observe(self, stats):
+        """Record a `couchdb.http.RequestStats` object."""
+        labels = (endpoint(url_template(stats.url)), stats.method)
+        if stats.status is None:
+            status = 'error'
+        else:
+            status = str(stats.status)
+        self.lock.acquire()
+        try:
+            key = labels + (status,)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._add('bytes_sent', labels, stats.bytes_sent)
+            self._add('bytes_received', labels, stats.bytes_received)
+            self._add('retries', labels, stats.retries)
+            if stats.not_modified:
+                self._add('not_modified', labels, 1)
+            self._observe('duration', labels, stats.duration)
+            self._observe('ttfb', labels, stats.ttfb)
+            self._observe('pool_wait', labels, stats.pool_wait)
+        finally:
+            self.lock.release()
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        self.lock.acquire()
+        try:
+            _header(lines, 'requests_total', 'counter',
+                    'Number of completed requests.')
+            for (name, method, status), value in sorted(self._requests.items()):
+                _sample(lines, 'requests_total', value, endpoint=name,
+                        method=method, code=status)
+            for name, help in _COUNTERS:
+                _header(lines, name + '_total', 'counter', help)
+                for key, value in sorted(self._counters.items()):
+                    if key[0] == name:
+                        _sample(lines, name + '_total', value,
+                                endpoint=key[1], method=key[2])
+            for name, help in _HISTOGRAMS:
+                metric = name + '_seconds'
+                _header(lines, metric, 'histogram', help)
+                for key, (counts, total) in sorted(self._histograms.items()):
+                    if key[0] != name:
+                        continue
+                    labels = {'endpoint': key[1], 'method': key[2]}
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, counts):
+                        cumulative += count
+                        _sample(lines, metric + '_bucket', cumulative,
+                                le=_format(bound), **labels)
+                    _sample(lines, metric + '_bucket', counts[-1] + cumulative,
+                            le='+Inf', **labels)
+                    _sample(lines, metric + '_sum', total, **labels)
+                    _sample(lines, metric + '_count',
+                            counts[-1] + cumulative, **labels)
+        finally:
+            self.lock.release()
+
+        if self.sessions:
+            pool = {}
+            cache = {}
+            for session in self.sessions:
+                for key, value in session.connection_pool.stats().items():
+                    pool[key] = pool.get(key, 0) + value
+                for key, value in session.cache.stats().items():
+                    cache[key] = cache.get(key, 0) + value
+            _header(lines, 'pool_connections', 'gauge',
+                    'Number of pooled connections by state.')
+            _sample(lines, 'pool_connections', pool['idle'], state='idle')
+            _sample(lines, 'pool_connections', pool['in_use'], state='in_use')
+            for key in ('created', 'discarded'):
+                metric = 'pool_connections_%s_total' % key
+                _header(lines, metric, 'counter',
+                        'Number of connections %s by the pool.' % key)
+                _sample(lines, metric, pool[key])
+            for key, kind, help in _CACHE:
+                metric = 'cache_' + key
+                if kind == 'counter':
+                    metric += '_total'
+                _header(lines, metric, kind, help)
+                _sample(lines, metric, cache[key])
+
+        return '\n'.join(lines) + '\n'
+
+    def _add(self, name, labels, value):
+        # Must be called with the lock held.
+        key = (name,) + labels
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, value):
+        # Must be called with the lock held. The last element of the counts
+        # is for values above the largest bucket.
+        key = (name,) + labels
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1),
+                                                 0.0]
+        counts = histogram[0]
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[idx] += 1
+                break
+        else:
+            counts[-1] += 1
+        histogram[1] += value
+
+
+_COUNTERS = [
+    ('bytes_sent', 'Number of bytes sent in requests.'),
+    ('bytes_received', 'Number of bytes received in response bodies.'),
+    ('retries', 'Number of retried requests.'),
+    ('not_modified', 'Number of responses served from the cache after '
+                     'revalidation.'),
+]
+
+_HISTOGRAMS = [
+    ('duration', 'Total time taken by requests.'),
+    ('ttfb', 'Time from sending a request to receiving the response headers.'),
+    ('pool_wait', 'Time spent waiting for a pooled connection.'),
+]
+
+_CACHE = [
+    ('entries', 'gauge', 'Number of cached responses.'),
+    ('bytes', 'gauge', 'Total size of cached response bodies.'),
+    ('hits', 'counter', 'Number of cache lookups that found an entry.'),
+    ('misses', 'counter', 'Number of cache lookups that found no entry.'),
+    ('revalidations', 'counter', 'Number of cached responses revalidated.'),
+    ('evictions', 'counter', 'Number of cached responses evicted.'),
+]
+
+_PREFIX = 'couchdb_client_'
+
+
+def _header(lines, name, kind, help):
+    lines.append('# HELP %s%s %s' % (_PREFIX, name, help))
+    lines.append('# TYPE %s%s %s' % (_PREFIX, name, kind))
+
+
+def _sample(lines, name, value, **labels):
+    if labels:
+        name += '{%s}' % ','.join(['%s="%s"' % (key, _escape(labels[key]))
+                                   for key in sorted(labels)])
+    lines.append('%s%s %s' % (_PREFIX, name, _format(value)))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+                .replace('\n', '\\n')
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
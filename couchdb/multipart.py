@@ -17,11 +17,13 @@ except ImportError:
     from md5 import new as md5
 import sys
 
-__all__ = ['read_multipart', 'write_multipart']
+__all__ = ['read_multipart', 'write_multipart', 'MultipartReader',
+           'MultipartWriter', 'MultipartBody']
 __docformat__ = 'restructuredtext en'
 
 
 CRLF = '\r\n'
+BLOCK_SIZE = 1024 * 64
 
 
 def read_multipart(fileobj, boundary=None):
@@ -68,13 +70,8 @@ def read_multipart(fileobj, boundary=None):
         if in_headers:
             line = line.replace(CRLF, '\n')
             if line != '\n':
-                name, value = [item.strip() for item in line.split(':', 1)]
-                name = name.lower()
-                value, charset = header.decode_header(value)[0]
-                if charset is None:
-                    headers[name] = value
-                else:
-                    headers[name] = value.decode(charset)
+                name, value = _parse_header_line(line)
+                headers[name] = value
             else:
                 in_headers = False
                 mimetype, params = parse_header(headers.get('content-type'))
@@ -113,19 +110,165 @@ def read_multipart(fileobj, boundary=None):
         yield _current_part()
 
 
+def _parse_header_line(line):
+    name, value = [item.strip() for item in line.split(':', 1)]
+    value, charset = header.decode_header(value)[0]
+    if charset is not None:
+        value = value.decode(charset)
+    return name.lower(), value
+
+
+class MultipartReader(object):
+    r"""Streaming reader of flat MIME multipart content, whose parts are
+    file-like objects that are read from the underlying file on demand.
+
+    Unlike `read_multipart()`, which loads every part into memory, this
+    allows parts of any size to be processed in blocks:
+
+    >>> from StringIO import StringIO
+    >>> reader = MultipartReader(StringIO(
+    ...     '--==123456789==\r\n'
+    ...     'Content-Type: text/plain\r\n'
+    ...     '\r\n'
+    ...     'Just testing\r\n'
+    ...     '--==123456789==\r\n'
+    ...     '\r\n'
+    ...     'Still testing\r\n'
+    ...     '--==123456789==--\r\n'
+    ... ), '==123456789==')
+    >>> for headers, part in reader:
+    ...     print headers, repr(part.read(4)), repr(part.read())
+    {'content-type': 'text/plain'} 'Just' ' testing'
+    {} 'Stil' 'l testing'
+
+    Iterating over the reader yields a ``(headers, part)`` tuple for every
+    part, where ``headers`` is a dictionary of the MIME headers of the part
+    (with names lower-cased), and ``part`` is a file-like object with a
+    ``read()`` method. Any content of a part that has not been read when the
+    iteration continues is skipped.
+
+    :param fileobj: a file-like object reading the content of the envelope,
+                    starting with the first boundary (or a preamble)
+    :param boundary: the part boundary string
+    :since: 0.10
+    """
+
+    def __init__(self, fileobj, boundary):
+        self.fileobj = fileobj
+        self.delimiter = CRLF + '--' + boundary
+        # A line break is prepended so that the first boundary is matched
+        # like the others. Anything before it is a preamble.
+        self._buf = CRLF
+        self._part = None
+
+    def __iter__(self):
+        while self._read(BLOCK_SIZE):
+            pass
+        while True:
+            self._require(len(self.delimiter) + 2)
+            if not self._buf.startswith(self.delimiter):
+                raise ValueError('malformed multipart content')
+            if self._buf[len(self.delimiter):].startswith('--'):
+                self._buf = ''
+                break
+            self._buf = self._buf[len(self.delimiter):]
+            self._readline() # the rest of the boundary line
+            headers = {}
+            while True:
+                line = self._readline()
+                if line in (CRLF, '\n'):
+                    break
+                name, value = _parse_header_line(line)
+                headers[name] = value
+            self._part = _PartReader(self)
+            yield headers, self._part
+            self._part.closed = True
+            while self._read(BLOCK_SIZE):
+                pass
+
+    def _fill(self):
+        data = self.fileobj.read(BLOCK_SIZE)
+        if not data:
+            raise ValueError('multipart content ended unexpectedly')
+        self._buf += data
+
+    def _require(self, size):
+        while len(self._buf) < size:
+            self._fill()
+
+    def _readline(self):
+        while True:
+            pos = self._buf.find('\n')
+            if pos >= 0:
+                line, self._buf = self._buf[:pos + 1], self._buf[pos + 1:]
+                return line
+            self._fill()
+
+    def _read(self, size=None):
+        # Return up to `size` bytes of the current part, or an empty string
+        # once the next boundary has been reached. Data that could be the
+        # start of a boundary is kept in the buffer until that's clear.
+        while True:
+            pos = self._buf.find(self.delimiter)
+            if pos >= 0:
+                available = pos
+                break
+            available = len(self._buf) - len(self.delimiter) + 1
+            if available > 0:
+                break
+            self._fill()
+        if size is not None:
+            available = min(available, size)
+        data, self._buf = self._buf[:available], self._buf[available:]
+        return data
+
+
+class _PartReader(object):
+    """File-like object for the content of a part of a `MultipartReader`."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.closed = False
+
+    def read(self, size=-1):
+        if self.closed:
+            return ''
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                data = self.reader._read(BLOCK_SIZE)
+                if not data:
+                    break
+                chunks.append(data)
+            return ''.join(chunks)
+        chunks = []
+        while size > 0:
+            data = self.reader._read(size)
+            if not data:
+                break
+            chunks.append(data)
+            size -= len(data)
+        return ''.join(chunks)
+
+
 class MultipartWriter(object):
 
-    def __init__(self, fileobj, headers=None, subtype='mixed', boundary=None):
+    def __init__(self, fileobj, headers=None, subtype='mixed', boundary=None,
+                 envelope=True):
         self.fileobj = fileobj
         if boundary is None:
             boundary = self._make_boundary()
         self.boundary = boundary
-        if headers is None:
-            headers = {}
-        headers['Content-Type'] = 'multipart/%s; boundary="%s"' % (
+        self.content_type = 'multipart/%s; boundary="%s"' % (
             subtype, self.boundary
         )
-        self._write_headers(headers)
+        if envelope:
+            # Otherwise the content type is sent elsewhere, for example as an
+            # HTTP header
+            if headers is None:
+                headers = {}
+            headers['Content-Type'] = self.content_type
+            self._write_headers(headers)
 
     def open(self, headers=None, subtype='mixed', boundary=None):
         self.fileobj.write('--')
@@ -140,6 +283,9 @@ class MultipartWriter(object):
         self.fileobj.write(CRLF)
         if headers is None:
             headers = {}
+        if hasattr(content, 'read'):
+            self._add_file(mimetype, content, headers)
+            return
         if isinstance(content, unicode):
             ctype, params = parse_header(mimetype)
             if 'charset' in params:
@@ -157,6 +303,24 @@ class MultipartWriter(object):
             self.fileobj.write(content)
             self.fileobj.write(CRLF)
 
+    def _add_file(self, mimetype, fileobj, headers):
+        # The content is not hashed, as it is only read once. If the output
+        # is a `MultipartBody`, it isn't even read until the body is.
+        headers['Content-Type'] = mimetype
+        self._write_headers(headers)
+        if hasattr(self.fileobj, 'write_file'):
+            size = headers.get('Content-Length')
+            if size is None:
+                raise ValueError('file-like parts require a Content-Length')
+            self.fileobj.write_file(fileobj, int(size))
+        else:
+            while True:
+                block = fileobj.read(BLOCK_SIZE)
+                if not block:
+                    break
+                self.fileobj.write(block)
+        self.fileobj.write(CRLF)
+
     def close(self):
         self.fileobj.write('--')
         self.fileobj.write(self.boundary)
@@ -192,6 +356,128 @@ class MultipartWriter(object):
         self.close()
 
 
+class MultipartBody(object):
+    r"""File-like object for the output of a `MultipartWriter`, which keeps
+    references to file-like parts instead of copying them, and only reads
+    them as the body itself is read.
+
+    The total size of the body is known before it is read, so it can be sent
+    as an HTTP request body with a ``Content-Length`` header:
+
+    >>> from StringIO import StringIO
+    >>> body = MultipartBody()
+    >>> envelope = MultipartWriter(body, subtype='related',
+    ...                            boundary='==123456789==', envelope=False)
+    >>> envelope.content_type
+    'multipart/related; boundary="==123456789=="'
+    >>> envelope.add('text/plain', StringIO('Just testing'),
+    ...              {'Content-Length': '12'})
+    >>> envelope.close()
+    >>> body.length
+    98
+    >>> print body.read().replace('\r\n', '\n')
+    --==123456789==
+    Content-Length: 12
+    Content-Type: text/plain
+    <BLANKLINE>
+    Just testing
+    --==123456789==--
+    <BLANKLINE>
+
+    If all file-like parts support ``seek()``, so does the body, which allows
+    a request to be retried.
+
+    :since: 0.10
+    """
+
+    def __init__(self):
+        self.segments = [] # strings and (fileobj, start, size) tuples
+        self.length = 0
+        self.position = 0
+        self._index = 0 # the segment being read
+        self._offset = 0 # the position within that segment
+
+    def write(self, data):
+        if self.segments and not isinstance(self.segments[-1], tuple):
+            self.segments[-1] += data
+        else:
+            self.segments.append(data)
+        self.length += len(data)
+
+    def write_file(self, fileobj, size):
+        """Add `size` bytes from the current position of a file-like object
+        to the body, without reading them yet.
+        """
+        try:
+            start = fileobj.tell()
+        except (AttributeError, IOError, OSError):
+            start = None
+        self.segments.append((fileobj, start, size))
+        self.length += size
+
+    def read(self, size=-1):
+        chunks = []
+        while size and self._index < len(self.segments):
+            segment = self.segments[self._index]
+            if isinstance(segment, tuple):
+                fileobj, _, length = segment
+                wanted = length - self._offset
+                if size > 0:
+                    wanted = min(wanted, size)
+                data = fileobj.read(wanted)
+                if not data and wanted:
+                    raise IOError('file-like part ended before its '
+                                  'Content-Length')
+            else:
+                length = len(segment)
+                end = length
+                if size > 0:
+                    end = min(end, self._offset + size)
+                data = segment[self._offset:end]
+            chunks.append(data)
+            self._offset += len(data)
+            if size > 0:
+                size -= len(data)
+            if self._offset >= length:
+                self._index += 1
+                self._offset = 0
+        data = ''.join(chunks)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence != 0:
+            raise IOError('only absolute positions are supported')
+        index = 0
+        remaining = offset
+        while index < len(self.segments):
+            segment = self.segments[index]
+            if isinstance(segment, tuple):
+                length = segment[2]
+            else:
+                length = len(segment)
+            if remaining < length:
+                break
+            remaining -= length
+            index += 1
+        for idx in range(index, len(self.segments)):
+            if not isinstance(self.segments[idx], tuple):
+                continue
+            fileobj, start, _ = self.segments[idx]
+            if start is None:
+                raise IOError('file-like part does not support seeking')
+            if idx == index:
+                fileobj.seek(start + remaining)
+            else:
+                fileobj.seek(start)
+        self._index = index
+        self._offset = remaining
+        self.position = offset
+
+
 def write_multipart(fileobj, subtype='mixed', boundary=None):
     r"""Simple streaming MIME multipart writer.
 
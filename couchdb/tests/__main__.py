@@ -8,8 +8,8 @@
 
 import unittest
 
-from couchdb.tests import client, couch_tests, design, http, multipart, \
-                          mapping, view, package, tools
+from couchdb.tests import client, couch_tests, design, http, metrics, \
+                          multipart, mapping, view, package, tools
 
 
 def suite():
@@ -17,6 +17,7 @@ def suite():
     suite.addTest(client.suite())
     suite.addTest(design.suite())
     suite.addTest(http.suite())
+    suite.addTest(metrics.suite())
     suite.addTest(multipart.suite())
     suite.addTest(mapping.suite())
     suite.addTest(view.suite())
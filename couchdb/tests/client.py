@@ -6,8 +6,10 @@
 # This software is licensed as described in the file COPYING, which
 # you should have received as part of this distribution.
 
+from base64 import b64decode
 from datetime import datetime
 import doctest
+import gzip
 import os
 import os.path
 import shutil
@@ -18,7 +20,7 @@ import threading
 import unittest
 import urlparse
 
-from couchdb import client, http
+from couchdb import client, http, json, mapping
 from couchdb.tests import testutil
 
 
@@ -108,6 +110,15 @@ class ServerTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         self.assertTrue(aname in dbs)
         self.assertTrue(bname in dbs)
 
+    def test_iter_paged(self):
+        names = [self.temp_db()[0] for i in range(3)]
+        self.server.iter_batch = 1
+        dbs = [name for name in self.server]
+        self.assertEqual(sorted(dbs), dbs)
+        self.assertEqual(len(set(dbs)), len(dbs))
+        for name in names:
+            self.assertTrue(name in dbs)
+
     def test_len(self):
         self.temp_db()
         self.temp_db()
@@ -232,6 +243,28 @@ class DatabaseTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
             doc = None
         assert doc is None
 
+    def test_doc_revs_bulk(self):
+        doc = {'count': 0}
+        self.db['foo'] = doc
+        revs = [doc['_rev']]
+        for i in range(1, 5):
+            doc['count'] = i
+            self.db['foo'] = doc
+            revs.insert(0, doc['_rev'])
+
+        revisions = list(self.db.revisions('foo', bulk=True))
+        self.assertEqual(revs, [revision.rev for revision in revisions])
+        self.assertEqual([4, 3, 2, 1, 0],
+                         [revision['count'] for revision in revisions])
+        gen = self.db.revisions('crap', bulk=True)
+        self.assertRaises(StopIteration, lambda: gen.next())
+
+        self.assertTrue(self.db.compact())
+        while self.db.info()['compact_running']:
+            pass
+        revisions = list(self.db.revisions('foo', bulk=True))
+        self.assertEqual(revs[:1], [revision.rev for revision in revisions])
+
     def test_attachment_crud(self):
         doc = {'bar': 42}
         self.db['foo'] = doc
@@ -323,6 +356,108 @@ class DatabaseTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         self.db.put_attachment(doc, '{}', 'test.json', 'application/json')
         self.assertEqual(self.db.get_attachment(doc, 'test.json').read(), '{}')
 
+    def test_attachment_streaming(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            content = os.urandom(300000)
+            tmpfile = os.path.join(tmpdir, 'test.bin')
+            f = open(tmpfile, 'wb')
+            f.write(content)
+            f.close()
+            doc = {}
+            self.db['foo'] = doc
+            progress = []
+            f = open(tmpfile, 'rb')
+            try:
+                self.db.put_attachment(doc, f, content_type='application/octet-stream',
+                                       progress=lambda *args: progress.append(args))
+            finally:
+                f.close()
+            self.assertEqual((300000, 300000), progress[-1])
+
+            progress = []
+            dest = os.path.join(tmpdir, 'copy.bin')
+            size = self.db.get_attachment(doc, 'test.bin', dest=dest,
+                                          progress=lambda *args: progress.append(args))
+            self.assertEqual(300000, size)
+            self.assertEqual(300000, progress[-1][0])
+            f = open(dest, 'rb')
+            try:
+                self.assertEqual(content, f.read())
+            finally:
+                f.close()
+            self.assertTrue(self.db.get_attachment(doc, 'missing.bin',
+                                                   dest=dest) is None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_attachment_ranges(self):
+        content = os.urandom(100000)
+        doc = {}
+        self.db['foo'] = doc
+        self.db.put_attachment(doc, content, 'test.bin',
+                               'application/octet-stream')
+        progress = []
+        fileobj = StringIO()
+        size = self.db.get_attachment(doc, 'test.bin', dest=fileobj,
+                                      concurrency=3, range_size=30000,
+                                      progress=lambda *args: progress.append(args))
+        self.assertEqual(100000, size)
+        self.assertEqual(content, fileobj.getvalue())
+        self.assertEqual((100000, 100000), max(progress))
+
+    def test_save_with_attachments(self):
+        doc = {'_id': 'foo'}
+        self.db.save(doc)
+        self.db.put_attachment(doc, 'Foo', 'old.txt', 'text/plain')
+        doc = self.db['foo']
+        doc['title'] = 'Foo'
+        fileobj = StringIO('skipped Foo bar')
+        fileobj.read(8)
+        id, rev = self.db.save_with_attachments(doc, {
+            'new.txt': fileobj,
+            'data.json': ('{}', 'application/json'),
+            'empty.txt': ''
+        })
+        self.assertEqual(('foo', doc['_rev']), (id, rev))
+        self.assertTrue(rev.startswith('3-'))
+        stored = self.db['foo']
+        self.assertEqual('Foo', stored['title'])
+        self.assertEqual(['data.json', 'empty.txt', 'new.txt', 'old.txt'],
+                         sorted(stored['_attachments']))
+        self.assertEqual(sorted(stored['_attachments']),
+                         sorted(doc['_attachments']))
+        self.assertEqual('Foo bar',
+                         self.db.get_attachment(doc, 'new.txt').read())
+        self.assertEqual('application/json',
+                         stored['_attachments']['data.json']['content_type'])
+        self.assertEqual('Foo', self.db.get_attachment(doc, 'old.txt').read())
+
+        # The updated stubs keep the attachments on the next save
+        self.db.save(doc)
+        self.assertEqual(4, len(self.db['foo']['_attachments']))
+
+    def test_get_attachments_multipart(self):
+        content = os.urandom(100000)
+        doc = {'_id': 'foo'}
+        self.db.save_with_attachments(doc, {
+            'foo.bin': content,
+            'bar.txt': 'Foo bar baz ' * 1000
+        })
+        doc = self.db.get('foo', attachments=True, stream=True)
+        attachments = doc['_attachments']
+        self.assertEqual('Foo bar baz ' * 1000,
+                         attachments['bar.txt']['data'].read())
+        self.assertEqual(content, attachments['foo.bin']['data'].read())
+        self.assertEqual(0, self.db.resource.session.connection_pool
+                                                    .stats()['in_use'])
+
+        doc = self.db.get('foo', attachments=True)
+        self.assertEqual(0, self.db.resource.session.connection_pool
+                                                    .stats()['in_use'])
+        self.assertEqual(content,
+                         b64decode(doc['_attachments']['foo.bin']['data']))
+
     def test_include_docs(self):
         doc = {'foo': 42, 'bar': 40}
         self.db['foo'] = doc
@@ -343,6 +478,155 @@ class DatabaseTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         for idx, i in enumerate(range(1, 6, 2)):
             self.assertEqual(i, res[idx].key)
 
+    def test_iter_paged(self):
+        for i in range(7):
+            self.db['doc%d' % i] = {}
+        self.db.iter_batch = 3
+        self.assertEqual(['doc%d' % i for i in range(7)], list(self.db))
+
+    def test_contains_many(self):
+        for i in range(5):
+            self.db['doc%d' % i] = {}
+        del self.db['doc3']
+        ids = ['doc%d' % i for i in range(7)]
+        self.assertEqual([True, True, True, False, True, False, False],
+                         list(self.db.contains_many(iter(ids), chunk_size=2)))
+
+    def test_contains_many_with_filter(self):
+        self.db['foo'] = {}
+        id_filter = self.db.id_filter(capacity=100)
+        self.assertTrue('foo' in id_filter)
+        self.assertFalse('bar' in id_filter)
+        self.db['bar'] = {}
+        self.assertEqual([True, True, False],
+                         list(self.db.contains_many(['foo', 'bar', 'baz'],
+                                                    id_filter=id_filter)))
+        self.assertTrue('bar' in id_filter)
+
+    def test_get_many(self):
+        for i in range(10):
+            self.db['doc%d' % i] = {'i': i}
+        del self.db['doc5']
+        ids = ['doc%d' % (i % 12) for i in range(25)]
+        docs = list(self.db.get_many(iter(ids), chunk_size=4, concurrency=2,
+                                     default='missing'))
+        self.assertEqual(25, len(docs))
+        for id, doc in zip(ids, docs):
+            if id in ('doc5', 'doc10', 'doc11'):
+                self.assertEqual('missing', doc)
+            else:
+                self.assertEqual(id, doc.id)
+        self.assertEqual([], list(self.db.get_many([])))
+
+    def test_loader(self):
+        for i in range(5):
+            self.db['doc%d' % i] = {'i': i}
+        del self.db['doc4']
+        loader = self.db.loader(max_batch=3, delay=0.01)
+        futures = [loader.get_async('doc%d' % i) for i in range(6)]
+        futures.append(loader.get_async('doc0'))
+        docs = [future.result() for future in futures]
+        self.assertEqual([0, 1, 2, 3], [doc['i'] for doc in docs[:4]])
+        self.assertEqual([None, None], docs[4:6])
+        self.assertEqual(docs[0], docs[6])
+        self.assertFalse(docs[0] is docs[6])
+        self.assertEqual('doc1', loader.get('doc1').id)
+        self.assertEqual('missing', loader.get('doc4', 'missing'))
+
+    def test_batch_writer(self):
+        results = []
+        writer = self.db.batch_writer(max_docs=3, max_delay=None)
+        futures = [writer.save({'_id': 'doc%d' % i}, callback=results.append)
+                   for i in range(4)]
+        self.assertEqual([True, True, True, False],
+                         [future.done() for future in futures])
+        self.assertTrue('doc2' in self.db)
+        self.assertFalse('doc3' in self.db)
+        writer.flush()
+        self.assertTrue('doc3' in self.db)
+        self.assertEqual(4, len(results))
+        self.assertEqual((True, 'doc0'), futures[0].result()[:2])
+
+        with self.db.batch_writer() as writer:
+            deleted = writer.delete(self.db['doc0'])
+            conflict = writer.save({'_id': 'doc1'})
+        self.assertTrue(deleted.result()[0])
+        self.assertFalse('doc0' in self.db)
+        success, id, exc = conflict.result()
+        self.assertFalse(success)
+        self.assertTrue(isinstance(exc, http.ResourceConflict))
+
+    def test_batch_writer_mapping(self):
+        doc = mapping.Document(id='foo')
+        with self.db.batch_writer() as writer:
+            future = writer.save(doc)
+        self.assertEqual(future.result()[2], doc.rev)
+        self.assertEqual(self.db['foo'].rev, doc.rev)
+
+    def test_batch_writer_delay(self):
+        writer = self.db.batch_writer(max_delay=0.05)
+        future = writer.save({'_id': 'foo'})
+        self.assertTrue(future.result(timeout=5)[0])
+        self.assertTrue('foo' in self.db)
+
+    def test_bulk_update_chunked(self):
+        docs = [{'_id': 'doc%02d' % i, 'i': i} for i in range(23)]
+        results = self.db.update(docs, chunk_size=5, max_bytes=100,
+                                 concurrency=3)
+        self.assertEqual([doc['_id'] for doc in docs],
+                         [result[1] for result in results])
+        for doc, (success, id, rev) in zip(docs, results):
+            self.assertTrue(success)
+            self.assertEqual(rev, doc['_rev'])
+        self.assertEqual(23, len(self.db))
+        self.assertEqual([], self.db.update([], chunk_size=5))
+
+    def test_bulk_update_stream(self):
+        self.db['doc1'] = {}
+        docs = ({'_id': 'doc%d' % i} for i in range(500))
+        results = list(self.db.update_stream(docs))
+        self.assertEqual(500, len(results))
+        self.assertEqual(['doc%d' % i for i in range(500)],
+                         [result[1] for result in results])
+        self.assertFalse(results[1][0])
+        self.assertTrue(isinstance(results[1][2], http.ResourceConflict))
+        self.assertTrue(results[0][0])
+        self.assertEqual(self.db['doc0'].rev, results[0][2])
+
+    def test_bulk_update_merge(self):
+        for i in range(3):
+            self.db['counter%d' % i] = {'count': 10}
+        stale = [{'_id': 'counter%d' % i, 'count': 0} for i in range(3)]
+        calls = []
+        def merge(doc, current):
+            calls.append(doc['_id'])
+            if doc['_id'] == 'counter2':
+                return None
+            current['count'] += 1
+            return current
+        results = self.db.update(stale, merge=merge)
+        self.assertEqual(['counter0', 'counter1', 'counter2'], calls)
+        self.assertEqual([True, True, False],
+                         [result[0] for result in results])
+        self.assertTrue(isinstance(results[2][2], http.ResourceConflict))
+        self.assertEqual(11, self.db['counter0']['count'])
+        self.assertEqual(11, stale[0]['count'])
+        self.assertEqual(results[0][2], stale[0]['_rev'])
+        self.assertEqual(10, self.db['counter2']['count'])
+
+    def test_bulk_update_merge_failed(self):
+        self.db['counter'] = {'count': 10}
+        stale = {'_id': 'counter', '_rev': '1-abc', 'count': {'value': 0}}
+        def merge(doc, current):
+            # Provoke another conflict by updating the document meanwhile
+            self.db['counter'] = dict(current)
+            doc['count']['value'] = current['count'] + 1
+            return doc
+        results = self.db.update([stale], merge=merge, merge_attempts=1)
+        self.assertFalse(results[0][0])
+        self.assertEqual({'_id': 'counter', '_rev': '1-abc',
+                          'count': {'value': 0}}, stale)
+
     def test_bulk_update_conflict(self):
         docs = [
             dict(type='Person', name='John Doe'),
@@ -487,6 +771,258 @@ class DatabaseTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         self.assertRaises(TypeError, self.db.save, doc)
 
 
+class BulkStreamTestCase(unittest.TestCase):
+
+    def test_body(self):
+        docs = ({'_id': 'doc%d' % i, 'text': u'\xe9t\xe9'} for i in range(3))
+        body = client._BulkDocsBody(docs, {'all_or_nothing': True})
+        parts = []
+        while True:
+            part = body.read(7)
+            if not part:
+                break
+            self.assertTrue(len(part) <= 7)
+            parts.append(part)
+        data = json.decode(''.join(parts))
+        self.assertEqual(True, data['all_or_nothing'])
+        self.assertEqual(['doc0', 'doc1', 'doc2'],
+                         [doc['_id'] for doc in data['docs']])
+        self.assertEqual(u'\xe9t\xe9', data['docs'][0]['text'])
+
+    def test_empty_body(self):
+        body = client._BulkDocsBody(iter([]), {})
+        self.assertEqual({'docs': []}, json.decode(body.read()))
+
+    def test_iter_json_array(self):
+        text = '[{"id": "a", "rev": "1-x"},\n {"id": "}]\\"\\\\", ' \
+               '"error": "conflict", "nested": [1, {"b": "["}]}]'
+        class Reader(object):
+            # returns the text one byte at a time
+            def __init__(self, text):
+                self.fileobj = StringIO(text)
+            def read(self, size):
+                return self.fileobj.read(1)
+        items = list(client._iter_json_array(Reader(text)))
+        self.assertEqual(json.decode(text), items)
+        self.assertEqual([], list(client._iter_json_array(StringIO('[]'))))
+
+
+    def test_update_stream_eager(self):
+        class Body(StringIO):
+            closed_count = 0
+            def close(self):
+                self.closed_count += 1
+        response = Body('[{"id": "a", "rev": "1-x"}, '
+                        '{"id": "b", "error": "conflict", "reason": "x"}]')
+        requests = []
+        def post(path, body=None, headers=None, **params):
+            requests.append(json.decode(body.read()))
+            return 201, {}, response
+        db = client.Database('http://localhost:5984/python-tests')
+        db.resource.post = post
+        results = db.update_stream([{'_id': 'a'}, {'_id': 'b'}])
+        self.assertEqual(1, len(requests))
+        self.assertEqual(['a', 'b'], [doc['_id'] for doc in
+                                      requests[0]['docs']])
+        self.assertEqual((True, u'a', u'1-x'), results.next())
+        self.assertFalse(results.next()[0])
+        self.assertRaises(StopIteration, results.next)
+        self.assertEqual(1, response.closed_count)
+
+    def test_update_stream_closed(self):
+        body = StringIO('[{"id": "a", "rev": "1-x"}]')
+        db = client.Database('http://localhost:5984/python-tests')
+        db.resource.post = lambda *args, **kwargs: (201, {}, body)
+        db.update_stream([{'_id': 'a'}]).close()
+        self.assertTrue(body.closed)
+
+
+class AttachmentStreamTestCase(unittest.TestCase):
+
+    def test_copy_stream(self):
+        progress = []
+        dest = StringIO()
+        size = client._copy_stream(StringIO('x' * 2500), dest, 1000,
+                                   lambda *args: progress.append(args), 2500)
+        self.assertEqual(2500, size)
+        self.assertEqual('x' * 2500, dest.getvalue())
+        self.assertEqual([(1000, 2500), (2000, 2500), (2500, 2500)], progress)
+
+    def test_copy_response_body(self):
+        class Response(StringIO):
+            def isclosed(self):
+                return self.tell() == len(self.getvalue())
+        body = http.ResponseBody(Response('x' * 20000), None)
+        dest = StringIO()
+        self.assertEqual(20000, client._copy_stream(body, dest, 8192))
+        self.assertEqual('x' * 20000, dest.getvalue())
+
+        body = http.ResponseBody(Response('x' * 20000), None)
+        dest = tempfile.TemporaryFile()
+        try:
+            self.assertEqual(20000, client._copy_stream(body, dest, 8192))
+            dest.seek(0)
+            self.assertEqual('x' * 20000, dest.read())
+        finally:
+            dest.close()
+
+    def test_remaining_size(self):
+        fileobj = StringIO('Foo bar baz')
+        fileobj.read(4)
+        self.assertEqual(7, client._remaining_size(fileobj))
+        fileobj = tempfile.TemporaryFile()
+        try:
+            fileobj.write('Foo bar baz')
+            fileobj.seek(8)
+            self.assertEqual(3, client._remaining_size(fileobj))
+        finally:
+            fileobj.close()
+        self.assertEqual(None, client._remaining_size(object()))
+
+    def test_progress_reader(self):
+        progress = []
+        reader = client._ProgressReader(StringIO('Foo bar baz'),
+                                        lambda *args: progress.append(args), 11)
+        self.assertEqual('Foo b', reader.read(5))
+        self.assertEqual('ar baz', reader.read())
+        self.assertEqual([(5, 11), (11, 11)], progress)
+        reader.seek(0)
+        self.assertEqual('Foo', reader.read(3))
+        self.assertEqual((3, 11), progress[-1])
+
+
+class MultipartDocTestCase(unittest.TestCase):
+
+    def _response(self, *attachments):
+        # attachments are (name, content, headers) tuples
+        stubs = ','.join(['"%s": {"content_type": "text/plain", '
+                          '"length": %d, "follows": true}' % (name, len(data))
+                          for name, data, _ in attachments])
+        parts = ['--abc\r\nContent-Type: application/json\r\n\r\n'
+                 '{"_id": "foo", "title": "bar.txt", '
+                 '"_attachments": {%s}}' % stubs]
+        for name, data, headers in attachments:
+            parts.append('\r\n--abc\r\n%s\r\n%s' % (headers, data))
+        parts.append('\r\n--abc--')
+        headers = {'content-type': 'multipart/related; boundary="abc"'}
+        return headers, StringIO(''.join(parts))
+
+    def test_order(self):
+        headers, body = self._response(('foo.txt', 'Foo', ''),
+                                       ('bar.txt', 'Bar', ''))
+        doc = client._read_multipart_doc(headers, body)
+        self.assertEqual('bar.txt', doc['title'])
+        attachments = doc['_attachments']
+        self.assertFalse('follows' in attachments['foo.txt'])
+        self.assertEqual('Bar', attachments['bar.txt']['data'].read())
+        self.assertEqual('Foo', attachments['foo.txt']['data'].read())
+        self.assertTrue(body.closed)
+
+    def test_file_names(self):
+        headers, body = self._response(
+            ('foo.txt', 'Foo',
+             'Content-Disposition: attachment; filename="bar.txt"\r\n'),
+            ('bar.txt', 'Bar',
+             'Content-Disposition: attachment; filename="foo.txt"\r\n'))
+        doc = client._read_multipart_doc(headers, body)
+        attachments = doc['_attachments']
+        self.assertEqual('Foo', attachments['bar.txt']['data'].read())
+        self.assertEqual('Bar', attachments['foo.txt']['data'].read())
+
+    def test_gzip(self):
+        buf = StringIO()
+        fileobj = gzip.GzipFile(fileobj=buf, mode='wb')
+        fileobj.write('Foo bar baz ' * 1000)
+        fileobj.close()
+        headers, body = self._response(
+            ('foo.txt', buf.getvalue(), 'Content-Encoding: gzip\r\n'),
+            ('bar.txt', 'Bar', ''))
+        doc = client._read_multipart_doc(headers, body)
+        data = doc['_attachments']['foo.txt']['data']
+        self.assertEqual('Foo bar baz ', data.read(12))
+        self.assertEqual('Bar', doc['_attachments']['bar.txt']['data'].read())
+        self.assertEqual('Foo bar baz ' * 999, data.read())
+
+    def test_close(self):
+        headers, body = self._response(('foo.txt', 'Foo', ''),
+                                       ('bar.txt', 'Bar', ''))
+        doc = client._read_multipart_doc(headers, body)
+        attachments = doc['_attachments']
+        self.assertEqual('F', attachments['foo.txt']['data'].read(1))
+        attachments['foo.txt']['data'].close()
+        self.assertFalse(body.closed)
+        attachments['bar.txt']['data'].close()
+        self.assertTrue(body.closed)
+        self.assertRaises(ValueError, attachments['bar.txt']['data'].read)
+
+    def test_json(self):
+        headers = {'content-type': 'application/json'}
+        doc = client._read_multipart_doc(headers, StringIO('{"_id": "foo"}'))
+        self.assertEqual({'_id': 'foo'}, doc)
+
+    def test_json_attachments(self):
+        headers = {'content-type': 'application/json'}
+        body = StringIO('{"_id": "foo", "_attachments": {'
+                        '"foo.txt": {"data": "Rm9v"}, '
+                        '"bar.txt": {"stub": true}}}')
+        attachments = client._read_multipart_doc(headers, body)['_attachments']
+        self.assertEqual('Foo', attachments['foo.txt']['data'].read())
+        self.assertEqual({'stub': True}, attachments['bar.txt'])
+
+
+class RangeTargetTestCase(unittest.TestCase):
+
+    def test_file(self):
+        fileobj = tempfile.TemporaryFile()
+        try:
+            target = client._RangeTarget(fileobj, 9)
+            self.assertEqual(9, os.fstat(fileobj.fileno()).st_size)
+            target.write(6, 'baz')
+            target.write(0, 'Foo')
+            target.write(3, 'bar')
+            target.close()
+            self.assertEqual(9, fileobj.tell())
+            fileobj.seek(0)
+            self.assertEqual('Foobarbaz', fileobj.read())
+        finally:
+            fileobj.close()
+
+    def test_file_object_offset(self):
+        progress = []
+        fileobj = StringIO()
+        fileobj.write('head')
+        target = client._RangeTarget(fileobj, 6,
+                                     lambda *args: progress.append(args))
+        target.write(3, 'bar')
+        target.write(0, 'Foo')
+        target.close()
+        self.assertEqual('headFoobar', fileobj.getvalue())
+        self.assertEqual(10, fileobj.tell())
+        self.assertEqual([(3, 6), (6, 6)], progress)
+
+
+class IdFilterTestCase(unittest.TestCase):
+
+    def test_sizing(self):
+        id_filter = client.IdFilter(None, capacity=1000, error_rate=0.01)
+        self.assertEqual(9586, id_filter.num_bits)
+        self.assertEqual(7, id_filter.num_hashes)
+        self.assertEqual(1199, len(id_filter.bits))
+
+    def test_membership(self):
+        id_filter = client.IdFilter(None, capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            id_filter.add('doc%d' % i)
+        id_filter.add(u'd\xf6c')
+        self.assertEqual(1001, id_filter.count)
+        for i in range(1000):
+            self.assertTrue('doc%d' % i in id_filter)
+        self.assertTrue(u'd\xf6c' in id_filter)
+        false_positives = len([i for i in range(10000)
+                               if 'other%d' % i in id_filter])
+        self.assertTrue(false_positives < 300)
+
+
 class ViewTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
 
     def test_row_object(self):
@@ -797,6 +1333,11 @@ def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ServerTestCase, 'test'))
     suite.addTest(unittest.makeSuite(DatabaseTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(BulkStreamTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(AttachmentStreamTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(MultipartDocTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RangeTargetTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(IdFilterTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ViewTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ShowListTestCase, 'test'))
     suite.addTest(unittest.makeSuite(UpdateHandlerTestCase, 'test'))
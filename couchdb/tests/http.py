@@ -7,15 +7,65 @@
 # you should have received as part of this distribution.
 
 import doctest
+import errno
 import socket
+import threading
 import time
 import unittest
 from StringIO import StringIO
+import zlib
 
 from couchdb import http
 from couchdb.tests import testutil
 
 
+class TestStream(StringIO):
+    """Response stream that is closed once it has been read to the end."""
+
+    def isclosed(self):
+        return len(self.buf) == self.tell()
+
+
+class TestServer(object):
+    """Local HTTP server that answers the requests it receives with the given
+    raw responses, in order, and records the request heads.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.url = 'http://127.0.0.1:%d/' % self.listener.getsockname()[1]
+        thread = threading.Thread(target=self._serve)
+        thread.setDaemon(True)
+        thread.start()
+
+    def close(self):
+        self.listener.close()
+
+    def _serve(self):
+        while self.responses:
+            try:
+                sock = self.listener.accept()[0]
+            except socket.error:
+                return
+            data = ''
+            while self.responses:
+                while '\r\n\r\n' not in data:
+                    bytes = sock.recv(4096)
+                    if not bytes:
+                        break
+                    data += bytes
+                if '\r\n\r\n' not in data:
+                    break
+                head, data = data.split('\r\n\r\n', 1)
+                self.requests.append(head)
+                sock.sendall(self.responses.pop(0))
+            sock.close()
+
+
 class SessionTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
 
     def test_timeout(self):
@@ -27,13 +77,21 @@ class SessionTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         self.assertRaises(socket.timeout, body.read)
         self.assertTrue(time.time() - start < timeout * 1.3)
 
+    def test_range_not_cached(self):
+        doc = {}
+        self.db['foo'] = doc
+        self.db.put_attachment(doc, 'Foo bar baz', 'foo.txt', 'text/plain')
+        session = self.db.resource.session
+        url = self.db.resource('foo', 'foo.txt').url
+        self.assertEqual('Foo bar baz', session.request('GET', url)[2].read())
+        status, _, data = session.request('GET', url,
+                                          headers={'Range': 'bytes=4-6'})
+        self.assertEqual((206, 'bar'), (status, data.read()))
+        self.assertEqual('Foo bar baz', session.cache.get(url)[2])
+
 
 class ResponseBodyTestCase(unittest.TestCase):
     def test_close(self):
-        class TestStream(StringIO):
-            def isclosed(self):
-                return len(self.buf) == self.tell()
-
         class Counter(object):
             def __init__(self):
                 self.value = 0
@@ -50,6 +108,46 @@ class ResponseBodyTestCase(unittest.TestCase):
 
         self.assertEqual(counter.value, 1)
 
+    def test_tee(self):
+        bodies = []
+        response = http.ResponseBody(TestStream('foobar'), None)
+        response.tee(6, bodies.append)
+        self.assertEqual(response.read(4), 'foob')
+        self.assertEqual(bodies, [])
+        response.close()
+        self.assertEqual(bodies, ['foobar'])
+
+        response = http.ResponseBody(TestStream('foobar'), None)
+        response.tee(5, bodies.append)
+        response.read()
+        self.assertEqual(bodies, ['foobar'])
+
+    def test_gzip(self):
+        data = ''.join([str(i) for i in range(10000)])
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        response = http.ResponseBody(TestStream(http.gzip_compress(data)),
+                                     None, decoder=decoder)
+        chunks = []
+        while True:
+            chunk = response.read(1000)
+            chunks.append(chunk)
+            if len(chunk) < 1000:
+                break
+        self.assertEqual(''.join(chunks), data)
+        self.assertTrue(response.resp.isclosed())
+
+    def test_gzip_tee_closed_early(self):
+        data = ''.join([str(i) for i in range(100000)])
+        for size in (10, 100000):
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            stream = TestStream(http.gzip_compress(data))
+            response = http.ResponseBody(stream, None, decoder=decoder)
+            bodies = []
+            response.tee(len(data), bodies.append)
+            response.read(size)
+            response.close()
+            self.assertEqual([data], bodies)
+
     def test_double_iteration_over_same_response_body(self):
         class TestHttpResp(object):
             msg = {'transfer-encoding': 'chunked'}
@@ -67,7 +165,585 @@ class ResponseBodyTestCase(unittest.TestCase):
         self.assertEqual(list(response.iterchunks()), [])
 
 
-class CacheTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
+class LineReaderTestCase(unittest.TestCase):
+
+    class TestHttpResp(object):
+        msg = {'transfer-encoding': 'chunked'}
+
+        def __init__(self, chunks):
+            data = ''.join(['%x\r\n%s\r\n' % (len(c), c) for c in chunks])
+            self.fp = StringIO(data + '0\r\n\r\n')
+            self.closed = False
+
+        def isclosed(self):
+            return self.closed
+
+        def close(self):
+            self.closed = True
+
+    def test_lines_across_chunks(self):
+        resp = self.TestHttpResp(['{"a":', '1}\n{"b"', ':2}\r\n\n{"c":3}\n'])
+        released = []
+        body = http.ResponseBody(resp, lambda: released.append(True))
+        self.assertEqual(list(body.iterchunks()),
+                         ['{"a":1}', '{"b":2}', '', '{"c":3}'])
+        self.assertEqual(released, [True])
+
+    def test_trailing_line(self):
+        resp = self.TestHttpResp(['foo\nb', 'ar'])
+        body = http.ResponseBody(resp, lambda: None)
+        self.assertEqual(list(body.iterchunks()), ['foo', 'bar'])
+
+    def test_trailing_carriage_return(self):
+        resp = self.TestHttpResp(['foo\r\nbar\r'])
+        body = http.ResponseBody(resp, lambda: None)
+        self.assertEqual(list(body.iterchunks()), ['foo', 'bar'])
+
+    def test_decoder_flushed(self):
+        class BufferingDecoder(object):
+            data = ''
+            def decompress(self, bytes):
+                self.data += bytes
+                return ''
+            def flush(self):
+                return self.data
+        resp = self.TestHttpResp(['foo\nb', 'ar'])
+        body = http.ResponseBody(resp, lambda: None,
+                                 decoder=BufferingDecoder())
+        self.assertEqual(list(body.iterchunks()), ['foo', 'bar'])
+
+    def test_max_line_length(self):
+        resp = self.TestHttpResp(['foo\n', 'x' * 5, 'x' * 5])
+        discarded = []
+        body = http.ResponseBody(resp, lambda: None,
+                                 lambda: discarded.append(True))
+        lines = body.iterchunks(max_line_length=8)
+        self.assertEqual(lines.next(), 'foo')
+        self.assertRaises(ValueError, lines.next)
+        self.assertEqual(discarded, [True])
+
+    def test_readinto(self):
+        body = http.ResponseBody(TestStream('foobar'), lambda: None)
+        buf = bytearray(4)
+        self.assertEqual(body.readinto(buf), 4)
+        self.assertEqual(str(buf), 'foob')
+        self.assertEqual(body.readinto(buf), 2)
+        self.assertEqual(str(buf[:2]), 'ar')
+
+
+class ExecutorTestCase(unittest.TestCase):
+
+    def test_submit(self):
+        executor = http.Executor(max_workers=2)
+        futures = [executor.submit(pow, i, 2) for i in range(10)]
+        self.assertEqual([f.result() for f in futures],
+                         [i * i for i in range(10)])
+        self.assertTrue(executor.workers <= 2)
+
+    def test_exception(self):
+        executor = http.Executor()
+        future = executor.submit(int, 'foo')
+        self.assertRaises(ValueError, future.result)
+        self.assertTrue(isinstance(future.exception(), ValueError))
+
+    def test_timeout(self):
+        future = http.Future()
+        self.assertRaises(http.Timeout, future.result, 0.01)
+        self.assertFalse(future.done())
+
+    def test_done_callback(self):
+        done = []
+        future = http.Future()
+        future.add_done_callback(done.append)
+        self.assertEqual(done, [])
+        future.set_result(42)
+        self.assertEqual(done, [future])
+        future.add_done_callback(done.append)
+        self.assertEqual(done, [future, future])
+
+    def test_map_order(self):
+        executor = http.Executor(max_workers=4)
+        def delayed(i):
+            time.sleep(0.01 * (5 - i))
+            return i
+        self.assertEqual(list(executor.map(delayed, range(5))), range(5))
+
+    def test_map_waits_after_failure(self):
+        executor = http.Executor(max_workers=4)
+        done = []
+        def call(i):
+            if i == 0:
+                raise ValueError(i)
+            time.sleep(0.02)
+            done.append(i)
+        self.assertRaises(ValueError, list, executor.map(call, range(4)))
+        self.assertEqual([1, 2, 3], sorted(done))
+
+    def test_map_in_worker(self):
+        executor = http.Executor(max_workers=2)
+        def fan_out(count):
+            return sum(executor.map(abs, range(-count, 0), 2))
+        futures = [executor.submit(fan_out, 3), executor.submit(fan_out, 4)]
+        self.assertEqual([6, 10], [f.result(1) for f in futures])
+
+    def test_session_submit(self):
+        session = http.Session(max_workers=1)
+        self.assertEqual(session.submit(len, 'foo').result(), 3)
+        self.assertEqual(session.executor.max_workers, 1)
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.url = 'http://127.0.0.1:%d/' % self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_reuse(self):
+        pool = http.ConnectionPool(None)
+        conn = pool.get(self.url)
+        pool.release(self.url, conn)
+        self.assertTrue(pool.get(self.url) is conn)
+
+    def test_max_size(self):
+        pool = http.ConnectionPool(None, max_size=2, wait_timeout=0.01)
+        conns = [pool.get(self.url), pool.get(self.url)]
+        self.assertRaises(http.Timeout, pool.get, self.url)
+        pool.release(self.url, conns[0])
+        self.assertTrue(pool.get(self.url) is conns[0])
+        pool.discard(self.url, conns[1])
+        self.assertTrue(pool.get(self.url) not in conns)
+
+    def test_wait_for_release(self):
+        pool = http.ConnectionPool(None, max_size=1)
+        conn = pool.get(self.url)
+        timer = threading.Timer(0.01, pool.release, (self.url, conn))
+        timer.start()
+        self.assertTrue(pool.get(self.url) is conn)
+        timer.join()
+
+    def test_idle_timeout(self):
+        pool = http.ConnectionPool(None, idle_timeout=0.01)
+        conn = pool.get(self.url)
+        pool.release(self.url, conn)
+        time.sleep(0.02)
+        self.assertTrue(pool.get(self.url) is not conn)
+        self.assertEqual(pool.counts[('http', self.url[7:-1])], 1)
+
+    def test_stale_connection(self):
+        pool = http.ConnectionPool(None)
+        conn = pool.get(self.url)
+        conn.connect()
+        self.listener.accept()[0].close()
+        pool.release(self.url, conn)
+        time.sleep(0.01)
+        self.assertTrue(pool.get(self.url) is not conn)
+
+    def test_prewarm(self):
+        pool = http.ConnectionPool(None, max_size=3)
+        pool.prewarm(self.url, 5)
+        self.assertEqual(len(pool.conns[('http', self.url[7:-1])]), 3)
+
+    def test_truncated_response(self):
+        def _serve():
+            sock = self.listener.accept()[0]
+            sock.recv(4096)
+            sock.sendall('HTTP/1.1 200 OK\r\n'
+                         'Content-Type: application/json\r\n'
+                         'Content-Length: 100\r\n\r\n{}')
+            sock.close()
+        thread = threading.Thread(target=_serve)
+        thread.start()
+        session = http.Session(max_connections=1, pool_timeout=0.01,
+                               retry_delays=[])
+        self.assertRaises(Exception, session.request, 'GET', self.url)
+        thread.join()
+        stats = session.connection_pool.stats()
+        self.assertEqual((0, 0), (stats['in_use'], stats['idle']))
+        self.assertEqual(1, stats['discarded'])
+
+    def test_error_before_send(self):
+        body = StringIO('{}')
+        body.close()
+        session = http.Session(max_connections=1, pool_timeout=0.01)
+        self.assertRaises(ValueError, session.request, 'PUT', self.url, body)
+        self.assertEqual(0, session.connection_pool.stats()['in_use'])
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+
+    def test_fixed_delays(self):
+        policy = http.RetryPolicy([0, 1])
+        error = socket.error(errno.ECONNRESET)
+        self.assertEqual(policy.delay('POST', 0, error=error), 0)
+        self.assertEqual(policy.delay('POST', 1, error=error), 1)
+        self.assertEqual(policy.delay('POST', 2, error=error), None)
+        self.assertEqual(policy.delay('GET', 0, status=503), None)
+
+    def test_backoff(self):
+        policy = http.BackoffRetryPolicy(max_retries=3, base_delay=1,
+                                         max_delay=3)
+        for attempt, limit in enumerate([1, 2, 3]):
+            delay = policy.delay('GET', attempt, status=503)
+            self.assertTrue(0 <= delay <= limit)
+        self.assertEqual(policy.delay('GET', 3, status=503), None)
+        self.assertEqual(policy.delay('GET', 0, status=404), None)
+
+    def test_idempotency(self):
+        policy = http.BackoffRetryPolicy()
+        self.assertEqual(policy.delay('POST', 0, status=503), None)
+        reset = socket.error(errno.ECONNRESET)
+        self.assertEqual(policy.delay('POST', 0, error=reset), None)
+        self.assertNotEqual(policy.delay('PUT', 0, error=reset), None)
+        refused = socket.error(errno.ECONNREFUSED)
+        self.assertNotEqual(policy.delay('POST', 0, error=refused), None)
+
+    def test_budget(self):
+        policy = http.BackoffRetryPolicy(budget=0.5, max_tokens=2)
+        self.assertNotEqual(policy.delay('GET', 0, status=503), None)
+        self.assertNotEqual(policy.delay('GET', 0, status=503), None)
+        self.assertEqual(policy.delay('GET', 0, status=503), None)
+        policy.started('GET')
+        self.assertEqual(policy.delay('GET', 0, status=503), None)
+        policy.started('GET')
+        self.assertNotEqual(policy.delay('GET', 0, status=503), None)
+
+    def test_circuit_breaker(self):
+        url = 'http://localhost:5984/foo'
+        breaker = http.CircuitBreaker(threshold=2, reset_timeout=0.05)
+        breaker.failure(url)
+        breaker.before(url)
+        breaker.failure(url)
+        self.assertRaises(http.CircuitOpen, breaker.before, url)
+        breaker.before('http://localhost:5985/')
+        time.sleep(0.06)
+        breaker.before(url) # trial request
+        self.assertRaises(http.CircuitOpen, breaker.before, url)
+        breaker.success(url)
+        breaker.before(url)
+
+    def test_session_fails_fast(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+        listener.close()
+        session = http.Session(retry_policy=http.BackoffRetryPolicy(
+                                   base_delay=0.001),
+                               circuit_breaker=http.CircuitBreaker(5))
+        # The first request gives up after three retries, and the breaker
+        # opens on the first failure of the second request
+        self.assertRaises(socket.error, session.request, 'GET', url)
+        self.assertRaises(http.CircuitOpen, session.request, 'GET', url)
+        self.assertRaises(http.CircuitOpen, session.request, 'GET', url)
+        self.assertEqual(session.connection_pool.counts.values(), [0])
+
+    def test_open_circuit_skips_pool(self):
+        url = 'http://127.0.0.1:5984/'
+        breaker = http.CircuitBreaker(1)
+        session = http.Session(max_connections=1, pool_timeout=0.01,
+                               circuit_breaker=breaker)
+        conn = session.connection_pool.get(url)
+        breaker.failure(url)
+        self.assertRaises(http.CircuitOpen, session.request, 'GET', url)
+        session.connection_pool.release(url, conn)
+        self.assertEqual(1, session.connection_pool.stats()['idle'])
+
+    def test_session_attributes(self):
+        session = http.Session(retry_delays=[0, 1])
+        self.assertEqual([0, 1], session.retry_delays)
+        session.retry_delays = [2]
+        session.retryable_errors = [errno.EPIPE]
+        self.assertEqual([2], session.retry_policy.delays)
+        self.assertEqual(set([errno.EPIPE]),
+                         session.retry_policy.retryable_errors)
+
+
+class HooksTestCase(unittest.TestCase):
+
+    def test_failed_request(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/mydb/mydoc' % listener.getsockname()[1]
+        listener.close()
+        seen = []
+        session = http.Session(retry_policy=http.RetryPolicy([0.001, 0.001]),
+                               hooks=[seen.append])
+        self.assertRaises(socket.error, session.request, 'GET', url)
+        self.assertEqual(len(seen), 1)
+        stats = seen[0]
+        self.assertEqual(stats.method, 'GET')
+        self.assertEqual(stats.url_template, '/{db}/{docid}')
+        self.assertEqual(stats.status, None)
+        self.assertEqual(stats.retries, 2)
+        self.assertEqual(stats.error.args[0], errno.ECONNREFUSED)
+
+    def test_non_string_header(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        url = 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+        def _serve():
+            sock = listener.accept()[0]
+            sock.recv(4096)
+            sock.sendall('HTTP/1.1 200 OK\r\n'
+                         'Content-Type: application/json\r\n'
+                         'Content-Length: 2\r\n\r\n{}')
+            sock.close()
+        thread = threading.Thread(target=_serve)
+        thread.start()
+        seen = []
+        session = http.Session(max_connections=1, hooks=[seen.append])
+        try:
+            status, msg, data = session.request('GET', url,
+                                                headers={'X-Count': 5})
+        finally:
+            thread.join()
+            listener.close()
+        self.assertEqual(200, status)
+        self.assertTrue(seen[0].bytes_sent > len('X-Count: 5'))
+
+
+class CoalesceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.session = http.Session(coalesce=True)
+        self.calls = []
+        self.release = threading.Event()
+        def _request(method, url, body=None, headers=None, credentials=None,
+                     num_redirects=0):
+            self.calls.append((method, url))
+            self.release.wait()
+            if url.endswith('missing'):
+                raise http.ResourceNotFound(('not_found', 'missing'))
+            return 200, {}, StringIO('{"url": "%s"}' % url)
+        self.session._request = _request
+
+    def _run(self, *args):
+        results = []
+        def _call():
+            try:
+                results.append(self.session.request(*args)[2].read())
+            except Exception, e:
+                results.append(e)
+        thread = threading.Thread(target=_call)
+        thread.start()
+        return thread, results
+
+    def _wait_for(self, count):
+        for idx in range(100):
+            if len(self.calls) >= count:
+                break
+            time.sleep(0.01)
+
+    def test_identical_requests(self):
+        url = 'http://localhost:5984/db/doc'
+        first, results1 = self._run('GET', url)
+        self._wait_for(1)
+        second, results2 = self._run('GET', url)
+        other, results3 = self._run('GET', url, None, {'X-Foo': 'bar'})
+        self._wait_for(2)
+        time.sleep(0.05)
+        self.release.set()
+        for thread in (first, second, other):
+            thread.join()
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(results1, ['{"url": "%s"}' % url])
+        self.assertEqual(results2, results1)
+        self.assertEqual(results3, results1)
+        self.assertEqual(self.session.in_flight, {})
+
+    def test_shared_error(self):
+        url = 'http://localhost:5984/db/missing'
+        first, results1 = self._run('GET', url)
+        self._wait_for(1)
+        second, results2 = self._run('GET', url)
+        time.sleep(0.05)
+        self.release.set()
+        first.join()
+        second.join()
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(isinstance(results2[0], http.ResourceNotFound))
+        self.assertEqual(self.session.in_flight, {})
+
+    def test_not_coalesced(self):
+        self.release.set()
+        self.session.request('PUT', 'http://localhost:5984/db/doc', '{}')
+        self.session.request('GET', 'http://localhost:5984/db/_changes')
+        self.session.request('GET', 'http://localhost:5984/_db_updates'
+                                    '?feed=continuous')
+        self.session.request('GET', 'http://localhost:5984/db/doc/att',
+                             headers={'Range': 'bytes=0-9'})
+        self.session.request('GET', 'http://localhost:5984/db/doc', headers={
+            'Accept': 'multipart/related, application/json'
+        })
+        self.assertEqual(len(self.calls), 5)
+        self.assertEqual(self.session.in_flight, {})
+
+
+class ClusterSessionTestCase(unittest.TestCase):
+
+    def _unused_url(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+        listener.close()
+        return url
+
+    def test_failover(self):
+        nodes = [self._unused_url(), self._unused_url()]
+        seen = []
+        session = http.ClusterSession(nodes, retry_delays=[],
+                                      hooks=[seen.append])
+        self.assertRaises(socket.error, session.request, 'GET',
+                          nodes[0] + 'db/doc')
+        self.assertEqual(sorted([stats.url for stats in seen]),
+                         sorted([node + 'db/doc' for node in nodes]))
+        self.assertEqual([node.failures for node in session.nodes], [1, 1])
+        self.assertEqual([node.outstanding for node in session.nodes], [0, 0])
+
+    def test_no_failover_for_post(self):
+        nodes = [self._unused_url(), self._unused_url()]
+        seen = []
+        session = http.ClusterSession(nodes, retry_delays=[],
+                                      hooks=[seen.append])
+        self.assertRaises(socket.error, session.request, 'POST',
+                          nodes[1] + 'db', body={})
+        self.assertEqual(len(seen), 1)
+
+    def test_least_outstanding(self):
+        session = http.ClusterSession(['http://a:5984', 'http://b:5984'])
+        first = session._choose([])
+        second = session._choose([])
+        self.assertNotEqual(first, second)
+        session._done(first, 0.1)
+        self.assertEqual(session._choose([]), first)
+
+    def test_ewma(self):
+        session = http.ClusterSession(['http://a:5984', 'http://b:5984'],
+                                      strategy='ewma')
+        slow, fast = session.nodes
+        for node, elapsed in [(slow, 0.5), (fast, 0.1)]:
+            node.outstanding += 1
+            session._done(node, elapsed)
+        self.assertEqual(session._choose([]), fast)
+        self.assertEqual(session._choose([]), fast)
+
+    def test_ejection(self):
+        session = http.ClusterSession(['http://a:5984', 'http://b:5984'],
+                                      max_failures=2, eject_timeout=0.05)
+        bad, good = session.nodes
+        for idx in range(2):
+            bad.outstanding += 1
+            session._done(bad, 0.0, failed=True)
+        for idx in range(3):
+            self.assertEqual(session._choose([]), good)
+        # Ejected nodes are still used when no other node is left
+        self.assertEqual(session._choose([good]), bad)
+        time.sleep(0.06)
+        good.outstanding = 3
+        self.assertEqual(session._choose([]), bad)
+
+    def test_hedge_delay(self):
+        session = http.ClusterSession(['http://a:5984', 'http://b:5984'],
+                                      hedge_percentile=90, hedge_delay=0.2)
+        self.assertEqual(session.hedge_delay(), 0.2)
+        session.latencies.extend([idx / 100.0 for idx in range(100)])
+        self.assertEqual(session.hedge_delay(), 0.9)
+
+    def _serve(self, delay=0):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        def _serve():
+            sock = listener.accept()[0]
+            sock.recv(4096)
+            time.sleep(delay)
+            try:
+                sock.sendall('HTTP/1.1 200 OK\r\n'
+                             'Content-Type: application/json\r\n'
+                             'Content-Length: 2\r\n\r\n{}')
+            except socket.error:
+                pass
+            sock.close()
+            listener.close()
+        thread = threading.Thread(target=_serve)
+        thread.setDaemon(True)
+        thread.start()
+        return 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+
+    def test_feeds_not_sampled(self):
+        session = http.ClusterSession([self._serve(), self._serve()],
+                                      strategy='ewma')
+        node = session.nodes[0]
+        session.request('GET', node.url + 'db/_changes?feed=longpoll')
+        self.assertEqual(len(session.latencies), 0)
+        self.assertEqual(node.latency, 0)
+        self.assertEqual(node.outstanding, 0)
+
+    def test_hedged_request(self):
+        nodes = [self._serve(delay=0.5), self._serve()]
+        session = http.ClusterSession(nodes, hedge_percentile=50,
+                                      hedge_delay=0.05, retry_delays=[])
+        slow, fast = session.nodes
+        fast.latency = 1.0 # make sure the request goes to the slow node first
+        started = time.time()
+        headers = {}
+        status, msg, data = session.request('GET', slow.url + 'db/doc',
+                                            headers=headers)
+        self.assertEqual(data.read(), '{}')
+        self.assertEqual({}, headers)
+        self.assertTrue(time.time() - started < 0.4)
+        self.assertEqual([slow.outstanding, fast.outstanding], [0, 0])
+        self.assertEqual(session.connection_pool.stats()['in_use'], 0)
+
+    def test_failover_headers(self):
+        ok = ('HTTP/1.1 200 OK\r\nETag: "1"\r\n'
+              'Content-Type: application/json\r\n'
+              'Content-Length: 2\r\n\r\n{}')
+        servers = [
+            TestServer([ok, 'HTTP/1.1 503 Service Unavailable\r\n'
+                            'Content-Length: 0\r\n\r\n']),
+            TestServer([ok])
+        ]
+        session = http.ClusterSession([server.url for server in servers])
+        first, second = session.nodes
+        second.latency = 1.0 # make sure requests go to the first node first
+        headers = {}
+        try:
+            for idx in range(2):
+                status, msg, data = session.request('GET',
+                                                    first.url + 'db/doc',
+                                                    headers=headers)
+                self.assertEqual((200, '{}'), (status, data.read()))
+        finally:
+            for server in servers:
+                server.close()
+        self.assertTrue('If-None-Match' in servers[0].requests[1])
+        self.assertFalse('If-None-Match' in servers[1].requests[0])
+        self.assertEqual({}, headers)
+
+    def test_hedged_failover(self):
+        nodes = [self._unused_url(), self._unused_url()]
+        seen = []
+        session = http.ClusterSession(nodes, retry_delays=[],
+                                      hedge_percentile=95, hooks=[seen.append])
+        self.assertRaises(socket.error, session.request, 'GET',
+                          nodes[0] + 'db/doc')
+        self.assertEqual(len(seen), 2)
+        self.assertEqual([node.outstanding for node in session.nodes], [0, 0])
+
+    def test_other_urls(self):
+        session = http.ClusterSession(['http://a:5984/'])
+        self.assertEqual(session._match('http://a:5984'), session.nodes[0])
+        self.assertEqual(session._match('http://a:5984/db'), session.nodes[0])
+        self.assertEqual(session._match('http://b:5984/db'), None)
+
+
+class CacheTestCase(unittest.TestCase):
 
     def test_remove_miss(self):
         """Check that a cache remove miss is handled gracefully."""
@@ -77,12 +753,111 @@ class CacheTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         cache.remove(url)
         cache.remove(url)
 
+    def test_lru_eviction(self):
+        cache = http.Cache(max_size=2)
+        cache.put('a', (200, {}, 'a'))
+        cache.put('b', (200, {}, 'b'))
+        cache.get('a')
+        cache.put('c', (200, {}, 'c'))
+        self.assertEqual(sorted(cache.by_url), ['a', 'c'])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_byte_budget(self):
+        cache = http.Cache(max_bytes=10)
+        cache.put('a', (200, {}, 'x' * 4))
+        cache.put('b', (200, {}, 'x' * 4))
+        cache.put('c', (200, {}, 'x' * 4))
+        self.assertEqual(sorted(cache.by_url), ['b', 'c'])
+        self.assertEqual(cache.size, 8)
+        cache.put('d', (200, {}, 'x' * 11))
+        self.assertEqual(cache.get('d'), None)
+        self.assertEqual(cache.size, 8)
+
+    def test_counters(self):
+        cache = http.Cache()
+        cache.put('a', (200, {}, 'a'))
+        cache.get('a')
+        cache.get('b')
+        cache.revalidated('a')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'],
+                          stats['revalidations'], stats['entries']),
+                         (1, 1, 1, 1))
+
+    def test_streamed_revalidated(self):
+        server = TestServer([
+            'HTTP/1.1 200 OK\r\nETag: "1"\r\n'
+            'Content-Type: application/json\r\n'
+            'Transfer-Encoding: chunked\r\n\r\n'
+            '6\r\n{"a": \r\n2\r\n1}\r\n0\r\n\r\n',
+            'HTTP/1.1 304 Not Modified\r\nETag: "1"\r\n\r\n'
+        ])
+        session = http.Session(cache_streamed=1024)
+        url = server.url + 'db/doc'
+        try:
+            status, msg, data = session.request('GET', url)
+            self.assertTrue(isinstance(data, http.ResponseBody))
+            self.assertEqual('{"a": 1}', data.read())
+            status, msg, data = session.request('GET', url)
+        finally:
+            server.close()
+        self.assertTrue('If-None-Match: "1"' in server.requests[1])
+        self.assertEqual((200, '{"a": 1}'), (status, data.read()))
+        self.assertEqual(1, session.cache.revalidations)
+
+    def test_other_formats_not_cached(self):
+        server = TestServer([
+            'HTTP/1.1 200 OK\r\nETag: "1"\r\n'
+            'Content-Type: multipart/related; boundary="abc"\r\n'
+            'Content-Length: 7\r\n\r\n--abc--',
+            'HTTP/1.1 200 OK\r\nETag: "1"\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: 2\r\n\r\n{}'
+        ])
+        session = http.Session()
+        url = server.url + 'db/doc'
+        try:
+            session.request('GET', url, headers={
+                'Accept': 'multipart/related, application/json'
+            })[2].read()
+            self.assertEqual(None, session.cache.get(url))
+            status, msg, data = session.request('GET', url)
+        finally:
+            server.close()
+        self.assertEqual((200, '{}'), (status, data.read()))
+        self.assertFalse('If-None-Match' in server.requests[1])
+
+    def test_unexpected_not_modified(self):
+        server = TestServer(['HTTP/1.1 304 Not Modified\r\n\r\n'])
+        session = http.Session()
+        try:
+            self.assertRaises(http.ServerError, session.request, 'GET',
+                              server.url + 'db/doc')
+        finally:
+            server.close()
+        self.assertEqual(0, session.connection_pool.stats()['in_use'])
+
+    def test_session_cache_dict(self):
+        by_url = {}
+        session = http.Session(cache=by_url)
+        session.cache.put('a', (200, {}, 'a'))
+        self.assertTrue('a' in by_url)
+        cache = http.Cache(max_size=1)
+        self.assertTrue(http.Session(cache=cache).cache is cache)
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(doctest.DocTestSuite(http))
     suite.addTest(unittest.makeSuite(SessionTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ResponseBodyTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(LineReaderTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ExecutorTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ConnectionPoolTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RetryPolicyTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(HooksTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(CoalesceTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ClusterSessionTestCase, 'test'))
     suite.addTest(unittest.makeSuite(CacheTestCase, 'test'))
     return suite
 
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 couchdb-python contributors
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+import doctest
+import unittest
+
+from couchdb import http, metrics
+
+
+class RegistryTestCase(unittest.TestCase):
+
+    def _stats(self, method, url, status=200, duration=0.02):
+        stats = http.RequestStats(method, url)
+        stats.status = status
+        stats.ttfb = duration
+        stats.bytes_received = 10
+        return stats
+
+    def test_requests(self):
+        registry = metrics.Registry()
+        registry(self._stats('GET', 'http://localhost:5984/db/doc'))
+        registry(self._stats('GET', 'http://localhost:5984/db/other', 404))
+        registry(self._stats('PUT', 'http://localhost:5984/db/doc', 201))
+        registry(self._stats('POST', 'http://localhost:5984/db/_bulk_docs',
+                             None))
+        text = registry.render()
+        self.assertTrue('couchdb_client_requests_total{code="200",'
+                        'endpoint="doc",method="GET"} 1\n' in text)
+        self.assertTrue('couchdb_client_requests_total{code="404",'
+                        'endpoint="doc",method="GET"} 1\n' in text)
+        self.assertTrue('couchdb_client_requests_total{code="201",'
+                        'endpoint="doc",method="PUT"} 1\n' in text)
+        self.assertTrue('couchdb_client_requests_total{code="error",'
+                        'endpoint="bulk_docs",method="POST"} 1\n' in text)
+        self.assertTrue('couchdb_client_bytes_received_total{'
+                        'endpoint="doc",method="GET"} 20\n' in text)
+        self.assertFalse('pool_connections' in text)
+
+    def test_histogram(self):
+        registry = metrics.Registry(buckets=[0.1, 0.01])
+        url = 'http://localhost:5984/db/_design/app/_view/all'
+        registry(self._stats('GET', url, duration=0.005))
+        registry(self._stats('GET', url, duration=0.05))
+        registry(self._stats('GET', url, duration=5))
+        text = registry.render()
+        prefix = 'couchdb_client_duration_seconds'
+        labels = 'endpoint="view",'
+        self.assertTrue('%s_bucket{%sle="0.01",method="GET"} 1\n'
+                        % (prefix, labels) in text)
+        self.assertTrue('%s_bucket{%sle="0.1",method="GET"} 2\n'
+                        % (prefix, labels) in text)
+        self.assertTrue('%s_bucket{%sle="+Inf",method="GET"} 3\n'
+                        % (prefix, labels) in text)
+        self.assertTrue('%s_count{%smethod="GET"} 3\n'
+                        % (prefix, labels) in text)
+
+    def test_session_gauges(self):
+        session = http.Session()
+        registry = metrics.Registry(session)
+        self.assertEqual(session.hooks, [registry])
+        session.cache.put('http://localhost:5984/db/doc', (200, {}, 'abc'))
+        text = registry.render()
+        self.assertTrue('couchdb_client_cache_entries 1\n' in text)
+        self.assertTrue('couchdb_client_cache_bytes 3\n' in text)
+        self.assertTrue('couchdb_client_pool_connections{state="in_use"} 0\n'
+                        in text)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(doctest.DocTestSuite(metrics))
+    suite.addTest(unittest.makeSuite(RegistryTestCase, 'test'))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -209,12 +209,147 @@ Content-Type: application/json
 {"_rev": "3-bc27b6930ca514527d8954c7c43e6a09", "_id": "文档"}
 ''', buf.getvalue().replace('\r\n', '\n'))
 
+    def test_file_content(self):
+        buf = StringIO()
+        envelope = multipart.write_multipart(buf, boundary='==123456789==')
+        envelope.add('text/plain', StringIO('Just testing'))
+        envelope.close()
+        self.assertEqual('''Content-Type: multipart/mixed; boundary="==123456789=="
+
+--==123456789==
+Content-Type: text/plain
+
+Just testing
+--==123456789==--
+''', buf.getvalue().replace('\r\n', '\n'))
+
+
+class MultipartBodyTestCase(unittest.TestCase):
+
+    def _make_body(self):
+        body = multipart.MultipartBody()
+        envelope = multipart.MultipartWriter(body, subtype='related',
+                                             boundary='==123456789==',
+                                             envelope=False)
+        envelope.add('application/json', '{}')
+        fileobj = StringIO('skipped Foo bar')
+        fileobj.read(8)
+        envelope.add('text/plain', fileobj, {'Content-Length': '7'})
+        envelope.add('text/plain', StringIO('baz'), {'Content-Length': '3'})
+        envelope.close()
+        return body
+
+    def test_read(self):
+        body = self._make_body()
+        data = body.read()
+        self.assertEqual(body.length, len(data))
+        self.assertEqual(body.length, body.tell())
+        self.assertTrue('\r\n\r\nFoo bar\r\n--==123456789==' in data)
+        self.assertTrue('\r\n\r\nbaz\r\n--==123456789==--' in data)
+        self.assertEqual('', body.read())
+
+    def test_read_blocks(self):
+        data = self._make_body().read()
+        body = self._make_body()
+        blocks = []
+        while True:
+            block = body.read(5)
+            if not block:
+                break
+            self.assertTrue(len(block) <= 5)
+            blocks.append(block)
+        self.assertEqual(data, ''.join(blocks))
+
+    def test_seek(self):
+        body = self._make_body()
+        data = body.read()
+        for position in range(body.length + 1):
+            body.seek(position)
+            self.assertEqual(data[position:], body.read())
+
+    def test_file_too_short(self):
+        body = multipart.MultipartBody()
+        envelope = multipart.MultipartWriter(body, envelope=False)
+        envelope.add('text/plain', StringIO('Foo'), {'Content-Length': '5'})
+        self.assertRaises(IOError, body.read)
+
+    def test_file_without_length(self):
+        body = multipart.MultipartBody()
+        envelope = multipart.MultipartWriter(body, envelope=False)
+        self.assertRaises(ValueError, envelope.add, 'text/plain',
+                          StringIO('Foo'))
+
+
+class MultipartReaderTestCase(unittest.TestCase):
+
+    content = (
+        'This is the preamble\r\n'
+        '--==123456789==\r\n'
+        'Content-Type: application/json\r\n'
+        '\r\n'
+        '{"_id": "foo"}\r\n'
+        '--==123456789==\r\n'
+        'Content-Type: text/plain\r\n'
+        '\r\n'
+        'Just testing\r\n'
+        '--==123456789==\r\n'
+        '\r\n'
+        '\r\n'
+        '--==123456789==--\r\n'
+    )
+
+    def test_parts(self):
+        reader = multipart.MultipartReader(StringIO(self.content),
+                                           '==123456789==')
+        parts = [(headers, part.read()) for headers, part in reader]
+        self.assertEqual([
+            ({'content-type': 'application/json'}, '{"_id": "foo"}'),
+            ({'content-type': 'text/plain'}, 'Just testing'),
+            ({}, '')
+        ], parts)
+
+    def test_small_reads(self):
+        class Reader(object):
+            # returns at most three bytes at a time
+            def __init__(self, text):
+                self.fileobj = StringIO(text)
+            def read(self, size):
+                return self.fileobj.read(min(size, 3))
+        reader = multipart.MultipartReader(Reader(self.content),
+                                           '==123456789==')
+        parts = []
+        for headers, part in reader:
+            chunks = []
+            while True:
+                chunk = part.read(2)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            parts.append(''.join(chunks))
+        self.assertEqual(['{"_id": "foo"}', 'Just testing', ''], parts)
+
+    def test_skip_parts(self):
+        reader = multipart.MultipartReader(StringIO(self.content),
+                                           '==123456789==')
+        parts = []
+        for headers, part in reader:
+            parts.append(part)
+        self.assertEqual(3, len(parts))
+        self.assertEqual('', parts[1].read())
+
+    def test_truncated(self):
+        reader = multipart.MultipartReader(StringIO(self.content[:100]),
+                                           '==123456789==')
+        self.assertRaises(ValueError, list, reader)
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(doctest.DocTestSuite(multipart))
     suite.addTest(unittest.makeSuite(ReadMultipartTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(MultipartReaderTestCase, 'test'))
     suite.addTest(unittest.makeSuite(WriteMultipartTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(MultipartBodyTestCase, 'test'))
     return suite
 
 